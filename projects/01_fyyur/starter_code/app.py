@@ -3,9 +3,14 @@
 #----------------------------------------------------------------------------#
 
 import json
+import csv
+import io
+import re
+import itertools
 import dateutil.parser
+from dateutil.rrule import rrule, rrulestr, WEEKLY
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort, stream_with_context, send_file
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
 import logging
@@ -13,6 +18,9 @@ from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
 from flask_migrate import Migrate
+from recommendations import Recommender, area_key
+from geo import GridIndex, load_cities
+from images import ImageStore
 import sys
 #----------------------------------------------------------------------------#
 # App Config.
@@ -32,6 +40,7 @@ migrate = Migrate(app, db)
 
 class Venue(db.Model):
     __tablename__ = 'Venue'
+    __table_args__ = (db.Index('ix_Venue_latitude_longitude', 'latitude', 'longitude'),)
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -45,6 +54,8 @@ class Venue(db.Model):
     website = db.Column(db.String(250))
     seeking_talent = db.Column(db.Boolean, nullable=False, default=False)
     seeking_description = db.Column(db.String(500))
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
     #One to many relationship venue=>shows
     shows = db.relationship('Show', backref="venue", lazy=True)
 
@@ -65,6 +76,8 @@ class Artist(db.Model):
     website = db.Column(db.String(250))
     seeking_venue = db.Column(db.Boolean, nullable=False, default=False)
     seeking_description = db.Column(db.String(500))
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
     #One to many relationship artist=>shows
     shows = db.relationship('Show', backref="artist", lazy=True)
 
@@ -84,6 +97,177 @@ class Show(db.Model):
   def __repr__(self):
       return f'<Show id: {self.id}, venue_id: {self.venue_id}, artist_id: {self.artist_id}>'
 
+# Denormalized read model for the show listings. One row per show carrying the
+# artist and venue names/images, so listing pages read a single narrow table.
+# Kept in sync in the same transaction as the Show/Artist/Venue writes below.
+class ShowListing(db.Model):
+  __tablename__ = 'show_listing'
+  # the INCLUDE columns of the venue/artist indexes are created by migration
+  # 3b8d2f61a9c4; postgresql_include needs a newer SQLAlchemy than this app uses
+  __table_args__ = (
+    db.Index('ix_show_listing_start_time', 'start_time'),
+    db.Index('ix_show_listing_venue_id_start_time', 'venue_id', 'start_time'),
+    db.Index('ix_show_listing_artist_id_start_time', 'artist_id', 'start_time'),
+  )
+
+  show_id = db.Column(db.Integer, db.ForeignKey('Show.id', ondelete='CASCADE'), primary_key=True)
+  start_time = db.Column(db.DateTime, nullable=False)
+  artist_id = db.Column(db.Integer, nullable=False)
+  artist_name = db.Column(db.String)
+  artist_image_link = db.Column(db.String(500))
+  venue_id = db.Column(db.Integer, nullable=False)
+  venue_name = db.Column(db.String)
+  venue_image_link = db.Column(db.String(500))
+
+  def __repr__(self):
+      return f'<ShowListing show_id: {self.show_id}, venue_id: {self.venue_id}, artist_id: {self.artist_id}>'
+
+def add_show_listing(show):
+  # show must be flushed so its id is known
+  artist = Artist.query.get(show.artist_id)
+  venue = Venue.query.get(show.venue_id)
+  db.session.add(ShowListing(
+    show_id=show.id,
+    start_time=show.start_time,
+    artist_id=artist.id,
+    artist_name=artist.name,
+    artist_image_link=artist.image_link,
+    venue_id=venue.id,
+    venue_name=venue.name,
+    venue_image_link=venue.image_link
+  ))
+
+def update_artist_listings(artist):
+  ShowListing.query.filter_by(artist_id=artist.id).update({
+    'artist_name': artist.name,
+    'artist_image_link': artist.image_link
+  }, synchronize_session=False)
+
+def update_venue_listings(venue):
+  ShowListing.query.filter_by(venue_id=venue.id).update({
+    'venue_name': venue.name,
+    'venue_image_link': venue.image_link
+  }, synchronize_session=False)
+
+def insert_show_listings(*criteria):
+  # INSERT ... SELECT the listing rows for the shows matching criteria
+  select = db.select([
+    Show.id, Show.start_time,
+    Artist.id, Artist.name, Artist.image_link,
+    Venue.id, Venue.name, Venue.image_link
+  ]).select_from(
+    Show.__table__.join(Artist.__table__, Show.artist_id == Artist.id).join(Venue.__table__, Show.venue_id == Venue.id)
+  ).where(db.and_(True, *criteria))
+  db.session.execute(ShowListing.__table__.insert().from_select([
+    'show_id', 'start_time',
+    'artist_id', 'artist_name', 'artist_image_link',
+    'venue_id', 'venue_name', 'venue_image_link'
+  ], select))
+
+def rebuild_show_listing():
+  ShowListing.query.delete(synchronize_session=False)
+  insert_show_listings()
+
+@app.cli.command('rebuild-show-listing')
+def rebuild_show_listing_command():
+  """Rebuild the show_listing read model from the Show, Artist and Venue tables."""
+  rebuild_show_listing()
+  db.session.commit()
+  print(f'show_listing rebuilt: {ShowListing.query.count()} rows')
+
+#----------------------------------------------------------------------------#
+# Recommendations.
+#----------------------------------------------------------------------------#
+
+recommender = Recommender(k=5)
+
+def get_recommender():
+  # built lazily from the catalog on first use, then kept up to date by the edit handlers
+  if not recommender.loaded:
+    recommender.load(
+      db.session.query(Venue.id, Venue.name, Venue.city, Venue.state, Venue.genres, Venue.seeking_talent),
+      db.session.query(Artist.id, Artist.name, Artist.city, Artist.state, Artist.genres, Artist.seeking_venue)
+    )
+  return recommender
+
+def recommend_venue(venue):
+  if recommender.loaded:
+    recommender.update('venue', venue.id, venue.name, venue.city, venue.state, venue.genres, venue.seeking_talent)
+
+def recommend_artist(artist):
+  if recommender.loaded:
+    recommender.update('artist', artist.id, artist.name, artist.city, artist.state, artist.genres, artist.seeking_venue)
+
+#----------------------------------------------------------------------------#
+# Geolocation.
+#----------------------------------------------------------------------------#
+
+cities = load_cities()
+venue_grid = GridIndex()
+METERS_PER_MILE = 1609.344
+MAX_NEARBY_RADIUS = 500
+earthdistance = None
+
+def locate(entity):
+  # coordinates come from the offline city table; unknown cities stay unlocated
+  entity.latitude, entity.longitude = cities.get(area_key(entity.city, entity.state), (None, None))
+
+def has_earthdistance():
+  global earthdistance
+  if earthdistance is None:
+    earthdistance = db.session.execute(
+      "SELECT 1 FROM pg_extension WHERE extname = 'earthdistance'"
+    ).first() is not None
+  return earthdistance
+
+def get_venue_grid():
+  if not venue_grid.loaded:
+    venue_grid.load(db.session.query(Venue.id, Venue.name, Venue.latitude, Venue.longitude))
+  return venue_grid
+
+def index_venue(venue):
+  if venue_grid.loaded:
+    venue_grid.update(venue.id, venue.name, venue.latitude, venue.longitude)
+
+def nearby_venues(lat, lng, radius):
+  # (distance in miles, id, name) for venues within radius miles, nearest first
+  if has_earthdistance():
+    rows = db.session.execute(
+      'SELECT id, name, earth_distance(ll_to_earth(:lat, :lng), ll_to_earth(latitude, longitude)) AS distance '
+      'FROM "Venue" '
+      'WHERE earth_box(ll_to_earth(:lat, :lng), :radius) @> ll_to_earth(latitude, longitude) '
+      'AND earth_distance(ll_to_earth(:lat, :lng), ll_to_earth(latitude, longitude)) <= :radius '
+      'ORDER BY distance',
+      {'lat': lat, 'lng': lng, 'radius': radius * METERS_PER_MILE}
+    )
+    return [(row.distance / METERS_PER_MILE, row.id, row.name) for row in rows]
+  return get_venue_grid().nearby(lat, lng, radius)
+
+@app.cli.command('geocode')
+def geocode_command():
+  """Fill in missing venue and artist coordinates from data/cities.csv."""
+  located = 0
+  for model in (Venue, Artist):
+    for entity in model.query.filter(model.latitude.is_(None)):
+      locate(entity)
+      located += entity.latitude is not None
+  db.session.commit()
+  print(f'{located} venues/artists located')
+
+#----------------------------------------------------------------------------#
+# Images.
+#----------------------------------------------------------------------------#
+
+image_store = ImageStore(app.config['UPLOAD_FOLDER'], logger=app.logger)
+MEDIA_LINK = re.compile(r'^/media/([0-9a-f]{64})/\w+$')
+
+def uploaded_image_link(image_link):
+  # an uploaded file wins over the image_link field; the stored link points at the large variant
+  upload = request.files.get('image_file')
+  if upload and upload.filename:
+    return url_for('media', digest=image_store.save(upload), variant='large')
+  return image_link
+
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
@@ -98,6 +282,15 @@ def format_datetime(value, format='medium'):
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+def image_variant(link, variant='thumb'):
+  # swap uploaded images for the requested size; external links are left alone
+  match = MEDIA_LINK.match(link or '')
+  if match:
+    return url_for('media', digest=match.group(1), variant=variant)
+  return link
+
+app.jinja_env.filters['image_variant'] = image_variant
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
@@ -106,6 +299,25 @@ app.jinja_env.filters['datetime'] = format_datetime
 def index():
   return render_template('pages/home.html')
 
+@app.route('/media/<digest>/<variant>')
+def media(digest, variant):
+  if not re.fullmatch(r'[0-9a-f]{64}', digest):
+    abort(404)
+  try:
+    path, final = image_store.path(digest, variant, webp='image/webp' in request.headers.get('Accept', ''))
+  except FileNotFoundError:
+    abort(404)
+
+  response = send_file(path, conditional=True)
+  # content-addressed, so a finished variant never changes; the original is
+  # only a stand-in until the worker pool has written the variant
+  if final:
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+  else:
+    response.headers['Cache-Control'] = 'no-cache'
+  response.headers['Vary'] = 'Accept'
+  return response
+
 
 #  Venues
 #  ----------------------------------------------------------------
@@ -154,6 +366,31 @@ def search_venues():
   }
   return render_template('pages/search_venues.html', results=response, search_term=search_term)
 
+@app.route('/venues/nearby')
+def nearby_venues_search():
+  lat = request.args.get('lat', type=float)
+  lng = request.args.get('lng', type=float)
+  radius = request.args.get('radius', 25, type=float)
+  # the chained comparisons also reject NaN
+  if lat is None or lng is None \
+      or not -90 <= lat <= 90 or not -180 <= lng <= 180 \
+      or not 0 < radius <= MAX_NEARBY_RADIUS:
+    abort(400)
+
+  venues_data = []
+  for distance, venue_id, name in nearby_venues(lat, lng, radius):
+    venues_data.append({
+      "id": venue_id,
+      "name": name,
+      "distance": round(distance, 1)
+    })
+  response = {
+    "count": len(venues_data),
+    "data": venues_data
+  }
+  search_term = f'within {radius:g} miles of {lat}, {lng}'
+  return render_template('pages/search_venues.html', results=response, search_term=search_term)
+
 @app.route('/venues/<int:venue_id>')
 def show_venue(venue_id):
 
@@ -162,24 +399,24 @@ def show_venue(venue_id):
   if not venue:
     return render_template('errors/404.html')
 
-  #get past and upcoming shows using start_time
-  past_shows_query = Show.query.filter(Show.venue_id == venue_id).filter(Show.start_time < datetime.today()).all()
+  #get past and upcoming shows using start_time, from the show_listing read model
+  past_shows_query = ShowListing.query.filter(ShowListing.venue_id == venue_id).filter(ShowListing.start_time < datetime.today()).all()
   past_shows = []
   for past_show in past_shows_query:
     past_shows.append({
       "artist_id": past_show.artist_id,
-      "artist_name": past_show.artist.name,
-      "artist_image_link": past_show.artist.image_link,
+      "artist_name": past_show.artist_name,
+      "artist_image_link": past_show.artist_image_link,
       "start_time": past_show.start_time.strftime('%Y-%m-%d %H:%M:%S')
     })
 
-  upcoming_shows_query = Show.query.filter(Show.venue_id == venue_id).filter(Show.start_time >= datetime.today()).all()
+  upcoming_shows_query = ShowListing.query.filter(ShowListing.venue_id == venue_id).filter(ShowListing.start_time >= datetime.today()).all()
   upcoming_shows = []
   for upcoming_show in upcoming_shows_query:
     upcoming_shows.append({
       "artist_id": upcoming_show.artist_id,
-      "artist_name": upcoming_show.artist.name,
-      "artist_image_link": upcoming_show.artist.image_link,
+      "artist_name": upcoming_show.artist_name,
+      "artist_image_link": upcoming_show.artist_image_link,
       "start_time": upcoming_show.start_time.strftime("%Y-%m-%d %H:%M:%S")    
     })    
   
@@ -203,7 +440,8 @@ def show_venue(venue_id):
     "past_shows": past_shows,
     "upcoming_shows": upcoming_shows,
     "past_shows_count": len(past_shows_query),
-    "upcoming_shows_count": len(upcoming_shows_query)
+    "upcoming_shows_count": len(upcoming_shows_query),
+    "recommended_artists": get_recommender().top('venue', venue.id)
   }
 #  print(data)
   return render_template('pages/show_venue.html', venue=data)
@@ -226,14 +464,17 @@ def create_venue_submission():
     venue.state = request.form['state']
     venue.address = request.form['address']
     venue.phone = request.form['phone']
-    venue.image_link = request.form['image_link']
+    venue.image_link = uploaded_image_link(request.form['image_link'])
     venue.facebook_link = request.form['facebook_link']
     venue.genres = request.form.getlist('genres')
     venue.website = request.form['website']
     venue.seeking_talent = True if 'seeking_talent' in request.form else False
     venue.seeking_description = request.form['seeking_description']
+    locate(venue)
     db.session.add(venue)
     db.session.commit()
+    recommend_venue(venue)
+    index_venue(venue)
   except:
     errorFlag = True
     db.session.rollback()
@@ -253,8 +494,11 @@ def delete_venue(venue_id):
   errorFlag = False
   try:
     venue = Venue.query.get(venue_id)
+    ShowListing.query.filter_by(venue_id=venue_id).delete(synchronize_session=False)
     db.session.delete(venue)
     db.session.commit()
+    recommender.remove('venue', venue_id)
+    venue_grid.remove(venue_id)
   except:
     errorFlag = True
     db.session.rollback()
@@ -304,23 +548,23 @@ def show_artist(artist_id):
   if not artist:
     return render_template('errors/404.html')
 
-  past_shows_query = Show.query.filter(Show.artist_id == artist_id).filter(Show.start_time < datetime.today()).all()
+  past_shows_query = ShowListing.query.filter(ShowListing.artist_id == artist_id).filter(ShowListing.start_time < datetime.today()).all()
   past_shows = []
   for past_show in past_shows_query:
     past_shows.append({
       "venue_id": past_show.venue_id,
-      "venue_name": past_show.venue.name,
-      "venue_image_link": past_show.venue.image_link,
+      "venue_name": past_show.venue_name,
+      "venue_image_link": past_show.venue_image_link,
       "start_time": past_show.start_time.strftime('%Y-%m-%d %H:%M:%S')
     })
 
-  upcoming_shows_query = Show.query.filter(Show.artist_id == artist_id).filter(Show.start_time >= datetime.today()).all()
+  upcoming_shows_query = ShowListing.query.filter(ShowListing.artist_id == artist_id).filter(ShowListing.start_time >= datetime.today()).all()
   upcoming_shows = []
   for upcoming_show in upcoming_shows_query:
     upcoming_shows.append({
       "venue_id": upcoming_show.venue_id,
-      "venue_name": upcoming_show.venue.name,
-      "venue_image_link": upcoming_show.venue.image_link,
+      "venue_name": upcoming_show.venue_name,
+      "venue_image_link": upcoming_show.venue_image_link,
       "start_time": upcoming_show.start_time.strftime("%Y-%m-%d %H:%M:%S")    
     })    
   
@@ -343,7 +587,8 @@ def show_artist(artist_id):
     "past_shows": past_shows,
     "upcoming_shows": upcoming_shows,
     "past_shows_count": len(past_shows_query),
-    "upcoming_shows_count": len(upcoming_shows_query)
+    "upcoming_shows_count": len(upcoming_shows_query),
+    "recommended_venues": get_recommender().top('artist', artist.id)
   }
 #  print(data)
   return render_template('pages/show_artist.html', artist=data)
@@ -377,14 +622,17 @@ def edit_artist_submission(artist_id):
     artist.city = request.form['city']
     artist.state = request.form['state']
     artist.phone = request.form['phone']
-    artist.image_link = request.form['image_link']
+    artist.image_link = uploaded_image_link(request.form['image_link'])
     artist.facebook_link = request.form['facebook_link']
     artist.genres = request.form.getlist('genres')
     artist.website = request.form['website']
     artist.seeking_venue = True if 'seeking_venue' in request.form else False 
     artist.seeking_description = request.form['seeking_description']
+    locate(artist)
+    update_artist_listings(artist)
 
     db.session.commit()
+    recommend_artist(artist)
   except:
     errorFlag = True
     db.session.rollback()
@@ -428,14 +676,18 @@ def edit_venue_submission(venue_id):
     venue.state = request.form['state']
     venue.address = request.form['address']
     venue.phone = request.form['phone']
-    venue.image_link = request.form['image_link']
+    venue.image_link = uploaded_image_link(request.form['image_link'])
     venue.facebook_link = request.form['facebook_link']
     venue.genres = request.form.getlist('genres')
     venue.website = request.form['website']
     venue.seeking_talent = True if 'seeking_talent' in request.form else False 
     venue.seeking_description = request.form['seeking_description']
+    locate(venue)
+    update_venue_listings(venue)
 
     db.session.commit()
+    recommend_venue(venue)
+    index_venue(venue)
   except:
     errorFlag = True
     db.session.rollback()
@@ -467,15 +719,17 @@ def create_artist_submission():
     artist.city = request.form['city']
     artist.state = request.form['state']
     artist.phone = request.form['phone']
-    artist.image_link = request.form['image_link']
+    artist.image_link = uploaded_image_link(request.form['image_link'])
     artist.facebook_link = request.form['facebook_link']
     artist.genres = request.form.getlist('genres')
-    website = request.form['website']
-    seeking_venue = True if 'seeking_venue' in request.form else False
-    seeking_description = request.form['seeking_description']
+    artist.website = request.form['website']
+    artist.seeking_venue = True if 'seeking_venue' in request.form else False
+    artist.seeking_description = request.form['seeking_description']
 
+    locate(artist)
     db.session.add(artist)
     db.session.commit()
+    recommend_artist(artist)
   except:
     errorFlag = True
     db.session.rollback()
@@ -496,15 +750,15 @@ def create_artist_submission():
 
 @app.route('/shows')
 def shows():
-  shows = Show.query.all()
+  shows = ShowListing.query.order_by(ShowListing.start_time).all()
   data = []
   for show in shows:
     data.append({
       "venue_id": show.venue_id,
-      "venue_name": show.venue.name,
+      "venue_name": show.venue_name,
       "artist_id": show.artist_id,
-      "artist_name": show.artist.name,
-      "artist_image_link": show.artist.image_link,
+      "artist_name": show.artist_name,
+      "artist_image_link": show.artist_image_link,
       "start_time": show.start_time.strftime('%Y-%m-%d %H:%M:%S')
     })
 
@@ -523,8 +777,10 @@ def create_show_submission():
     show = Show()
     show.artist_id = request.form['artist_id']
     show.venue_id = request.form['venue_id']
-    show.start_time = request.form['start_time']
+    show.start_time = dateutil.parser.parse(request.form['start_time'])
     db.session.add(show)
+    db.session.flush()
+    add_show_listing(show)
     db.session.commit()
   except:
     errorFlag = True
@@ -540,6 +796,164 @@ def create_show_submission():
 
   return render_template('pages/home.html')
 
+#  Export
+#  ----------------------------------------------------------------
+
+# rows fetched per round trip from the server-side cursor, and per chunk written
+EXPORT_CHUNK_SIZE = 1000
+
+def export_shows_query():
+  # artist and venue names are joined in SQL so no relationship is lazy loaded per row
+  return db.session.query(
+    Show.id,
+    Show.start_time,
+    Show.artist_id,
+    Artist.name.label('artist_name'),
+    Show.venue_id,
+    Venue.name.label('venue_name')
+  ).join(Artist, Show.artist_id == Artist.id).join(Venue, Show.venue_id == Venue.id).order_by(Show.id)
+
+def export_venues_query():
+  return db.session.query(
+    Venue.id, Venue.name, Venue.city, Venue.state, Venue.address, Venue.phone,
+    Venue.genres, Venue.website, Venue.facebook_link, Venue.image_link,
+    Venue.seeking_talent, Venue.seeking_description
+  ).order_by(Venue.id)
+
+def export_artists_query():
+  return db.session.query(
+    Artist.id, Artist.name, Artist.city, Artist.state, Artist.phone,
+    Artist.genres, Artist.website, Artist.facebook_link, Artist.image_link,
+    Artist.seeking_venue, Artist.seeking_description
+  ).order_by(Artist.id)
+
+EXPORT_QUERIES = {
+  'shows': export_shows_query,
+  'venues': export_venues_query,
+  'artists': export_artists_query
+}
+
+def export_value(value):
+  if isinstance(value, datetime):
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+  return value
+
+def stream_csv(query):
+  columns = [column['name'] for column in query.column_descriptions]
+  buffer = io.StringIO()
+  writer = csv.writer(buffer)
+  writer.writerow(columns)
+  for count, row in enumerate(query, 1):
+    writer.writerow([';'.join(value) if isinstance(value, list) else export_value(value) for value in row])
+    if count % EXPORT_CHUNK_SIZE == 0:
+      yield buffer.getvalue()
+      buffer.seek(0)
+      buffer.truncate(0)
+  yield buffer.getvalue()
+
+def stream_ndjson(query):
+  columns = [column['name'] for column in query.column_descriptions]
+  chunk = []
+  for row in query:
+    chunk.append(json.dumps(dict(zip(columns, map(export_value, row)))))
+    if len(chunk) == EXPORT_CHUNK_SIZE:
+      yield '\n'.join(chunk) + '\n'
+      chunk = []
+  if chunk:
+    yield '\n'.join(chunk) + '\n'
+
+EXPORT_FORMATS = {
+  'csv': (stream_csv, 'text/csv'),
+  'ndjson': (stream_ndjson, 'application/x-ndjson')
+}
+
+@app.route('/export/<entity>.<fmt>')
+def export(entity, fmt):
+  if entity not in EXPORT_QUERIES or fmt not in EXPORT_FORMATS:
+    abort(404)
+
+  # stream_results asks the driver for a server-side cursor, yield_per keeps
+  # only one chunk of rows in memory regardless of the table size
+  query = EXPORT_QUERIES[entity]().execution_options(stream_results=True).yield_per(EXPORT_CHUNK_SIZE)
+  stream, mimetype = EXPORT_FORMATS[fmt]
+
+  return Response(
+    stream_with_context(stream(query)),
+    mimetype=mimetype,
+    headers={'Content-Disposition': f'attachment; filename={entity}.{fmt}'}
+  )
+
+@app.route('/shows/recurring/create')
+def create_recurring_shows():
+  form = RecurringShowForm()
+  return render_template('forms/new_recurring_show.html', form=form)
+
+# upper bound on the shows a single series may create
+MAX_RECURRING_SHOWS = 520
+
+def expand_recurrence(recurrence, rule, start_time, end_date):
+  # dates from start_time through end_date, generated lazily and stopped one past
+  # MAX_RECURRING_SHOWS so the caller can reject a series that is too long
+  if recurrence == 'weekly':
+    dates = rrule(WEEKLY, dtstart=start_time, until=end_date)
+  elif recurrence == 'biweekly':
+    dates = rrule(WEEKLY, interval=2, dtstart=start_time, until=end_date)
+  elif recurrence == 'custom':
+    dates = rrulestr(rule, dtstart=start_time)
+  else:
+    raise ValueError(f'unknown recurrence {recurrence}')
+  # the rule starts at dtstart=start_time, so iterating it yields start_time onwards
+  in_range = itertools.takewhile(lambda date: date <= end_date, dates)
+  return list(itertools.islice(in_range, MAX_RECURRING_SHOWS + 1))
+
+@app.route('/shows/recurring/create', methods=['POST'])
+def create_recurring_shows_submission():
+  errorFlag = False
+  conflicts = []
+  dates = []
+  too_many = False
+  try:
+    artist_id = int(request.form['artist_id'])
+    venue_id = int(request.form['venue_id'])
+    start_time = dateutil.parser.parse(request.form['start_time'])
+    end_date = dateutil.parser.parse(request.form['end_date'])
+    dates = expand_recurrence(request.form['recurrence'], request.form.get('rrule', ''), start_time, end_date)
+    too_many = len(dates) > MAX_RECURRING_SHOWS
+    if too_many:
+      raise ValueError(f'series has more than {MAX_RECURRING_SHOWS} shows')
+    if not dates or Artist.query.get(artist_id) is None or Venue.query.get(venue_id) is None:
+      raise ValueError('empty series or unknown artist/venue')
+
+    # one query for the whole series: the venue or the artist is already booked at any of the dates
+    conflicts = db.session.query(Show.start_time).filter(
+      db.or_(Show.venue_id == venue_id, Show.artist_id == artist_id)
+    ).filter(Show.start_time.in_(dates)).order_by(Show.start_time).all()
+
+    if not conflicts:
+      db.session.execute(Show.__table__.insert(), [
+        {'artist_id': artist_id, 'venue_id': venue_id, 'start_time': date} for date in dates
+      ])
+      insert_show_listings(Show.artist_id == artist_id, Show.venue_id == venue_id, Show.start_time.in_(dates))
+      db.session.commit()
+  except:
+    errorFlag = True
+    db.session.rollback()
+    print(sys.exc_info())
+  finally:
+    db.session.close()
+
+  if too_many:
+    flash(f'Requested shows not listed. A series may have at most {MAX_RECURRING_SHOWS} shows; choose an earlier end date.')
+  elif errorFlag:
+    flash('An error occurred. Requested shows not listed.')
+  elif conflicts:
+    booked = ', '.join(conflict.start_time.strftime('%Y-%m-%d %H:%M') for conflict in conflicts)
+    flash(f'Requested shows not listed. The artist or venue is already booked at: {booked}')
+  else:
+    flash(f'{len(dates)} shows were successfully listed')
+
+  return render_template('pages/home.html')
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
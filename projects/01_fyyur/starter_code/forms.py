@@ -1,5 +1,6 @@
 from datetime import datetime
 from flask_wtf import Form
+from flask_wtf.file import FileField, FileAllowed
 from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField
 from wtforms.validators import DataRequired, AnyOf, URL
 
@@ -88,6 +89,9 @@ class VenueForm(Form):
     image_link = StringField(
         'image_link'
     )
+    image_file = FileField(
+        'image_file', validators=[FileAllowed(['jpg', 'jpeg', 'png', 'gif', 'webp'], 'Images only')]
+    )
     genres = SelectMultipleField(
         # TODO implement enum restriction
         'genres', validators=[DataRequired()],
@@ -196,6 +200,9 @@ class ArtistForm(Form):
     image_link = StringField(
         'image_link'
     )
+    image_file = FileField(
+        'image_file', validators=[FileAllowed(['jpg', 'jpeg', 'png', 'gif', 'webp'], 'Images only')]
+    )
     genres = SelectMultipleField(
         # TODO implement enum restriction
         'genres', validators=[DataRequired()],
@@ -245,4 +252,29 @@ class ShowForm(Form):
     )
     start_time = DateTimeField(
         'start_time', validators=[DataRequired()], default=datetime.today()
-    )
\ No newline at end of file
+    )
+class RecurringShowForm(Form):
+    artist_id = StringField(
+        'artist_id', validators=[DataRequired()]
+    )
+    venue_id = StringField(
+        'venue_id', validators=[DataRequired()]
+    )
+    start_time = DateTimeField(
+        'start_time', validators=[DataRequired()], default=datetime.today()
+    )
+    end_date = DateTimeField(
+        'end_date', validators=[DataRequired()]
+    )
+    recurrence = SelectField(
+        'recurrence', validators=[DataRequired()],
+        choices=[
+            ('weekly', 'Weekly'),
+            ('biweekly', 'Every two weeks'),
+            ('custom', 'Custom (RRULE)'),
+        ]
+    )
+    rrule = StringField(
+        # e.g. FREQ=MONTHLY;BYDAY=1FR
+        'rrule'
+    )
@@ -0,0 +1,109 @@
+from collections import defaultdict
+import csv
+import math
+import os
+import threading
+
+from recommendations import area_key
+
+EARTH_RADIUS_MILES = 3958.8
+MILES_PER_DEGREE_LAT = 69.17
+
+CITIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'cities.csv')
+
+
+def load_cities(path=CITIES_PATH):
+    '''Offline (city, state) -> (latitude, longitude) table.'''
+    cities = {}
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            cities[area_key(row['city'], row['state'])] = (float(row['latitude']), float(row['longitude']))
+    return cities
+
+
+def haversine_miles(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(a))
+
+
+class GridIndex(object):
+    '''
+    Fixed-size lat/lng grid over point entities.
+
+    A radius query only visits the cells overlapping the bounding box of the
+    search circle and then filters those points by great-circle distance, so
+    its cost depends on local density rather than on the total number of
+    points. A box larger than the occupied part of the grid visits only the
+    occupied cells.
+    '''
+
+    def __init__(self, cell_size=0.5):
+        self.cell_size = cell_size
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.cells = defaultdict(dict)  # (row, col) -> {id: (lat, lng, name)}
+        self.points = {}                # id -> cell
+
+    def cell(self, lat, lng):
+        return (int(math.floor(lat / self.cell_size)), int(math.floor(lng / self.cell_size)))
+
+    def load(self, rows):
+        '''rows is an iterable of (id, name, latitude, longitude).'''
+        with self.lock:
+            for id, name, lat, lng in rows:
+                if lat is not None and lng is not None:
+                    self._add(id, name, lat, lng)
+            self.loaded = True
+
+    def update(self, id, name, lat, lng):
+        with self.lock:
+            self._remove(id)
+            if lat is not None and lng is not None:
+                self._add(id, name, lat, lng)
+
+    def remove(self, id):
+        with self.lock:
+            self._remove(id)
+
+    def nearby(self, lat, lng, radius):
+        '''Points within radius miles of (lat, lng) as (distance, id, name), nearest first.'''
+        dlat = radius / MILES_PER_DEGREE_LAT
+        # longitude degrees shrink towards the poles; clamp to avoid dividing by ~0
+        dlng = radius / (MILES_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 0.01))
+        min_row, min_col = self.cell(lat - dlat, lng - dlng)
+        max_row, max_col = self.cell(lat + dlat, lng + dlng)
+
+        # copy the candidates under the lock; update() and remove() mutate the cells
+        candidates = []
+        with self.lock:
+            if (max_row - min_row + 1) * (max_col - min_col + 1) <= len(self.cells):
+                keys = ((row, col) for row in range(min_row, max_row + 1) for col in range(min_col, max_col + 1))
+            else:
+                # a box wider than the occupied grid only needs the occupied cells
+                keys = [key for key in self.cells
+                        if min_row <= key[0] <= max_row and min_col <= key[1] <= max_col]
+            for key in keys:
+                cell = self.cells.get(key)
+                if cell:
+                    candidates.extend(cell.items())
+
+        results = []
+        for id, (plat, plng, name) in candidates:
+            distance = haversine_miles(lat, lng, plat, plng)
+            if distance <= radius:
+                results.append((distance, id, name))
+        results.sort()
+        return results
+
+    def _add(self, id, name, lat, lng):
+        key = self.cell(lat, lng)
+        self.cells[key][id] = (lat, lng, name)
+        self.points[id] = key
+
+    def _remove(self, id):
+        key = self.points.pop(id, None)
+        if key is not None:
+            del self.cells[key][id]
+            if not self.cells[key]:
+                del self.cells[key]
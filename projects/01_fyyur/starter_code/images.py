@@ -0,0 +1,112 @@
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import io
+import logging
+import os
+
+try:
+    from PIL import Image
+except ImportError:
+    # without Pillow uploads are stored and served as-is, with no variants
+    Image = None
+
+ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'webp'}
+# Pillow format -> extension the original is stored under
+FORMAT_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+
+# variant name -> bounding box; each is written as both WebP and JPEG
+VARIANTS = {
+    'thumb': (320, 320),
+    'large': (1024, 1024),
+}
+
+
+def image_extension(data):
+    '''Extension for the image in data, or ValueError if Pillow cannot read it as an allowed format.'''
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            fmt = image.format
+            # checks the file's structure without decoding every pixel
+            image.verify()
+    except Exception as e:
+        raise ValueError(f'not a valid image: {e}') from e
+    if fmt not in FORMAT_EXTENSIONS:
+        raise ValueError(f'unsupported image format: {fmt}')
+    return FORMAT_EXTENSIONS[fmt]
+
+
+def make_variants(original, directory):
+    '''Runs in a worker process: write every variant next to the original.'''
+    with Image.open(original) as image:
+        image = image.convert('RGB')
+        for name, size in VARIANTS.items():
+            variant = image.copy()
+            variant.thumbnail(size)
+            # write to a temporary name first so a half-written file is never served
+            for ext, fmt, options in (('webp', 'WEBP', {'quality': 80}), ('jpg', 'JPEG', {'quality': 85, 'optimize': True})):
+                path = os.path.join(directory, f'{name}.{ext}')
+                variant.save(path + '.tmp', fmt, **options)
+                os.replace(path + '.tmp', path)
+
+
+class ImageStore(object):
+    '''
+    Content-addressed storage for uploaded images.
+
+    Uploads live under <root>/<digest[:2]>/<digest>/ where digest is the
+    SHA-256 of the file, so identical uploads are stored once and a given URL
+    never changes content. With Pillow installed, an upload is only stored
+    if Pillow can read it as one of the allowed formats. Resized variants are
+    produced in a process pool, off the request thread; until they exist the
+    original is served instead, and a failed resize is logged.
+    '''
+
+    def __init__(self, root, workers=2, logger=None):
+        self.root = root
+        self.workers = workers
+        self.pool = None
+        self.logger = logger or logging.getLogger(__name__)
+
+    def directory(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def save(self, upload):
+        '''Store a werkzeug FileStorage and return its digest.'''
+        ext = upload.filename.rsplit('.', 1)[-1].lower() if '.' in upload.filename else ''
+        if ext not in ALLOWED_EXTENSIONS:
+            raise ValueError(f'unsupported image type: {upload.filename}')
+
+        data = upload.read()
+        if Image is not None:
+            # the content decides the type, whatever the filename claims
+            ext = image_extension(data)
+        digest = hashlib.sha256(data).hexdigest()
+        directory = self.directory(digest)
+        original = os.path.join(directory, f'original.{ext}')
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+            with open(original + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(original + '.tmp', original)
+            if Image is not None:
+                if self.pool is None:
+                    self.pool = ProcessPoolExecutor(max_workers=self.workers)
+                future = self.pool.submit(make_variants, original, directory)
+                future.add_done_callback(lambda future: self.log_failure(future, original))
+        return digest
+
+    def log_failure(self, future, original):
+        if not future.cancelled() and future.exception() is not None:
+            self.logger.error('could not make image variants of %s', original, exc_info=future.exception())
+
+    def path(self, digest, variant, webp=True):
+        '''Best available file for a variant and whether it is the final variant.'''
+        directory = self.directory(digest)
+        if variant in VARIANTS:
+            path = os.path.join(directory, f"{variant}.{'webp' if webp else 'jpg'}")
+            if os.path.exists(path):
+                return path, True
+        for name in os.listdir(directory):
+            if name.startswith('original.') and not name.endswith('.tmp'):
+                return os.path.join(directory, name), False
+        raise FileNotFoundError(digest)
@@ -0,0 +1,52 @@
+"""show_listing read model
+
+Revision ID: 3b8d2f61a9c4
+Revises: fe05983682c0
+Create Date: 2026-10-18 10:12:31.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8d2f61a9c4'
+down_revision = 'fe05983682c0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('show_listing',
+    sa.Column('show_id', sa.Integer(), nullable=False),
+    sa.Column('start_time', sa.DateTime(), nullable=False),
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('artist_name', sa.String(), nullable=True),
+    sa.Column('artist_image_link', sa.String(length=500), nullable=True),
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.Column('venue_name', sa.String(), nullable=True),
+    sa.Column('venue_image_link', sa.String(length=500), nullable=True),
+    sa.ForeignKeyConstraint(['show_id'], ['Show.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('show_id')
+    )
+    op.create_index('ix_show_listing_start_time', 'show_listing', ['start_time'], unique=False)
+    # covering indexes: the venue/artist pages are served from the index alone
+    op.execute('CREATE INDEX ix_show_listing_venue_id_start_time ON show_listing (venue_id, start_time) '
+               'INCLUDE (artist_id, artist_name, artist_image_link)')
+    op.execute('CREATE INDEX ix_show_listing_artist_id_start_time ON show_listing (artist_id, start_time) '
+               'INCLUDE (venue_id, venue_name, venue_image_link)')
+
+    # backfill from the existing shows
+    op.execute('INSERT INTO show_listing (show_id, start_time, artist_id, artist_name, artist_image_link, '
+               'venue_id, venue_name, venue_image_link) '
+               'SELECT "Show".id, "Show".start_time, "Artist".id, "Artist".name, "Artist".image_link, '
+               '"Venue".id, "Venue".name, "Venue".image_link '
+               'FROM "Show" JOIN "Artist" ON "Show".artist_id = "Artist".id '
+               'JOIN "Venue" ON "Show".venue_id = "Venue".id')
+
+
+def downgrade():
+    op.drop_index('ix_show_listing_artist_id_start_time', table_name='show_listing')
+    op.drop_index('ix_show_listing_venue_id_start_time', table_name='show_listing')
+    op.drop_index('ix_show_listing_start_time', table_name='show_listing')
+    op.drop_table('show_listing')
@@ -0,0 +1,44 @@
+"""venue and artist coordinates
+
+Revision ID: 9e4a6c0d2b17
+Revises: 3b8d2f61a9c4
+Create Date: 2026-10-18 11:03:54.219870
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4a6c0d2b17'
+down_revision = '3b8d2f61a9c4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('Artist', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('Artist', sa.Column('longitude', sa.Float(), nullable=True))
+    op.add_column('Venue', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('Venue', sa.Column('longitude', sa.Float(), nullable=True))
+    op.create_index('ix_Venue_latitude_longitude', 'Venue', ['latitude', 'longitude'], unique=False)
+
+    # radius searches go through earth_box when the earthdistance extension is installed
+    op.execute('''
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'earthdistance') THEN
+                CREATE INDEX ix_Venue_earth ON "Venue" USING gist (ll_to_earth(latitude, longitude));
+            END IF;
+        END
+        $$;
+    ''')
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS ix_Venue_earth')
+    op.drop_index('ix_Venue_latitude_longitude', table_name='Venue')
+    op.drop_column('Venue', 'longitude')
+    op.drop_column('Venue', 'latitude')
+    op.drop_column('Artist', 'longitude')
+    op.drop_column('Artist', 'latitude')
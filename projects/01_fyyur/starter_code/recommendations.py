@@ -0,0 +1,121 @@
+from collections import defaultdict
+import heapq
+import threading
+
+OTHER_KIND = {'venue': 'artist', 'artist': 'venue'}
+
+
+def area_key(city, state):
+    return ((city or '').strip().lower(), state)
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class Recommender(object):
+    '''
+    In-memory matcher between venues and artists.
+
+    Venues are matched with artists seeking a venue, and artists with venues
+    seeking talent, in the same city/state and ranked by the Jaccard
+    similarity of their genres. Candidates come from an inverted
+    (area, genre) -> ids index, and each entity's top-k list is precomputed,
+    so serving a page is a dict lookup. Edits only re-rank the entities that
+    share an (area, genre) key with the old or new state of the edited one.
+    '''
+
+    def __init__(self, k=5):
+        self.k = k
+        self.lock = threading.Lock()
+        self.loaded = False
+        # id -> (area, genres, name, seeking)
+        self.entities = {'venue': {}, 'artist': {}}
+        # (area, genre) -> ids
+        self.index = {'venue': defaultdict(set), 'artist': defaultdict(set)}
+        # id -> [(score, other_id)], best first
+        self.matches = {'venue': {}, 'artist': {}}
+
+    def load(self, venues, artists):
+        '''venues/artists are iterables of (id, name, city, state, genres, seeking) rows.'''
+        with self.lock:
+            for kind, rows in (('venue', venues), ('artist', artists)):
+                for id, name, city, state, genres, seeking in rows:
+                    self._store(kind, id, (area_key(city, state), frozenset(genres or ()), name, seeking))
+            for kind in ('venue', 'artist'):
+                for id in self.entities[kind]:
+                    self.matches[kind][id] = self._rank(kind, id)
+            self.loaded = True
+
+    def update(self, kind, id, name, city, state, genres, seeking):
+        with self.lock:
+            affected = set()
+            old = self.entities[kind].get(id)
+            if old is not None:
+                self._unstore(kind, id)
+                affected |= self._neighbours(kind, old)
+            entity = (area_key(city, state), frozenset(genres or ()), name, seeking)
+            self._store(kind, id, entity)
+            affected |= self._neighbours(kind, entity)
+
+            self.matches[kind][id] = self._rank(kind, id)
+            other = OTHER_KIND[kind]
+            for other_id in affected:
+                self.matches[other][other_id] = self._rank(other, other_id)
+
+    def remove(self, kind, id):
+        with self.lock:
+            old = self.entities[kind].get(id)
+            if old is None:
+                return
+            self._unstore(kind, id)
+            self.matches[kind].pop(id, None)
+            other = OTHER_KIND[kind]
+            for other_id in self._neighbours(kind, old):
+                self.matches[other][other_id] = self._rank(other, other_id)
+
+    def top(self, kind, id):
+        '''Precomputed matches of the other kind for the given entity.'''
+        others = self.entities[OTHER_KIND[kind]]
+        results = []
+        for score, other_id in self.matches[kind].get(id, ()):
+            other = others.get(other_id)
+            if other is not None:
+                results.append({'id': other_id, 'name': other[2], 'score': round(score, 2)})
+        return results
+
+    def _store(self, kind, id, entity):
+        self.entities[kind][id] = entity
+        area, genres = entity[0], entity[1]
+        for genre in genres:
+            self.index[kind][(area, genre)].add(id)
+
+    def _unstore(self, kind, id):
+        area, genres = self.entities[kind].pop(id)[:2]
+        for genre in genres:
+            ids = self.index[kind][(area, genre)]
+            ids.discard(id)
+            if not ids:
+                del self.index[kind][(area, genre)]
+
+    def _neighbours(self, kind, entity):
+        '''Ids of the other kind sharing an (area, genre) key with entity.'''
+        area, genres = entity[0], entity[1]
+        index = self.index[OTHER_KIND[kind]]
+        ids = set()
+        for genre in genres:
+            ids |= index.get((area, genre), set())
+        return ids
+
+    def _rank(self, kind, id):
+        entity = self.entities[kind][id]
+        others = self.entities[OTHER_KIND[kind]]
+        scored = []
+        for other_id in self._neighbours(kind, entity):
+            other = others[other_id]
+            # only suggest the other side when it is actually looking
+            if other[3]:
+                scored.append((jaccard(entity[1], other[1]), other_id))
+        return heapq.nlargest(self.k, scored)
@@ -1,33 +1,144 @@
 import os
-from flask import Flask, request, abort, jsonify
-from flask_sqlalchemy import SQLAlchemy
+import json
+import hashlib
+import atexit
+import threading
+import click
+from flask import Flask, Response, request, abort, jsonify, stream_with_context
 from flask_cors import CORS
-import random
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 
-from models import setup_db, Question, Category
+from models import setup_db, database_path, db, Question, Category, category_version, question_version, \
+  touch_version, sync_versions
+from .quiz import QuizPool, QuizSessionStore, START_DIFFICULTY, valid_question_ids
+from .search import ranked_search
+from .schema import ensure_schema, migrate_question_category
+from .bulk import import_questions, export_questions, ImportFailed
+from .jsonprovider import init_json
+from .stats import QuestionStats, STATS_QUERY
+from .results import ResultRecorder, Leaderboard, valid_player
+from .rooms import RoomRegistry
+from .dedup import DuplicateIndex, fingerprint_text, question_key, default_index_path
+from .answers import AnswerCache
+from .singleflight import SingleFlight
 
 QUESTIONS_PER_PAGE = 10
+# picks of an already deleted question tolerated before a quiz request gives up
+MAX_STALE_PICKS = 3
 
-def paginate_questions(request, questions):
-  page = request.args.get('page', 1, type=int)
-  start = (page-1) * QUESTIONS_PER_PAGE
-  end = start + QUESTIONS_PER_PAGE 
-  
-  formatted_questions = [question.format() for question in questions]
-  current_questions = formatted_questions[start:end]
+# list endpoints select these columns as plain tuples and build the response
+# dicts directly, without ORM instances or the identity map
+QUESTION_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+QUESTION_COLUMNS = [getattr(Question, field) for field in QUESTION_FIELDS]
+
+def format_question_row(row):
+  # by position: ORM tuples and async driver records both support it
+  return {field: row[index] for index, field in enumerate(QUESTION_FIELDS)}
+
+def etag(body):
+  return hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+'''
+category_entry(version, rows)
+    the cached /categories data for (id, type) rows: the id->type dict, the
+    serialized body and its ETag.
+'''
+def category_entry(version, rows):
+  categories = {}
+  for category_id, category_type in rows:
+    categories[category_id] = category_type
+
+  body = json.dumps({
+    'success': True,
+    'categories': categories,
+    'total_categories': len(categories)
+  }, sort_keys=True)
+
+  return {
+    'version': version,
+    'categories': categories,
+    'body': body,
+    'etag': etag(body)
+  }
 
-  return current_questions
+'''
+paginate_questions(request, query)
+    pages a Question query in SQL and returns the page as dicts in the
+    shape of Question.format().
+    ?page=N uses LIMIT/OFFSET; ?after_id=N switches to keyset pagination
+    (questions with id > N), which stays cheap for deep pages.
+'''
+def paginate_questions(request, query):
+  query = query.order_by(Question.id)
+  after_id = request.args.get('after_id', type=int)
+  if after_id is not None:
+    query = query.filter(Question.id > after_id)
+  else:
+    page = request.args.get('page', 1, type=int)
+    if page < 1:
+      return []
+    query = query.offset((page-1) * QUESTIONS_PER_PAGE)
+
+  rows = query.with_entities(*QUESTION_COLUMNS).limit(QUESTIONS_PER_PAGE).all()
+  return [format_question_row(row) for row in rows]
+
+'''
+count_questions(query)
+    SELECT COUNT(*) for a Question query, without loading any rows.
+'''
+def count_questions(query):
+  return query.with_entities(func.count(Question.id)).scalar()
 
 
 def create_app(test_config=None):
   
   # create and configure the app 
   app = Flask(__name__)
-  setup_db(app)
+  app.config.from_mapping(
+    DATABASE_PATH=database_path,
+    SKIP_SCHEMA_CHECK=False,
+    JSON_PROVIDER='auto',
+    QUIZ_SESSIONS_MAX=10000,
+    QUIZ_SESSION_TTL=1800,
+    QUIZ_SESSION_SPILL=None,
+    RESULTS_FLUSH_INTERVAL=1.0,
+    RESULTS_BATCH_SIZE=500,
+    LEADERBOARD_SIZE=10,
+    ROOMS_MAX=1000,
+    ROOM_PLAYERS_MAX=50,
+    ROOM_TTL=600,
+    ROOM_SWEEP_INTERVAL=30,
+    ROOM_HEARTBEAT=15,
+    DUPLICATE_INDEX_PATH=None,
+    DUPLICATE_THRESHOLD=0.8,
+    DUPLICATE_INDEX_WAIT=5,
+    DUPLICATE_INDEX_PRELOAD=False,
+    ANSWER_CACHE_SIZE=10000,
+    HOT_READ_TTL=1.0,
+    HOT_READ_MAX_ENTRIES=256,
+    VERSION_CHECK_INTERVAL=1.0
+  )
+  if test_config is not None:
+    app.config.from_mapping(test_config)
+  # tables and indexes are only created when the stored schema version is
+  # stale; SKIP_SCHEMA_CHECK skips even that (e.g. workers after a deploy step)
+  setup_db(app, app.config['DATABASE_PATH'], create_tables=False)
+  if not app.config['SKIP_SCHEMA_CHECK']:
+    with app.app_context():
+      ensure_schema(app)
+
+  init_json(app)
 
   #CORS setup
   cors = CORS(app, resources={r"/*": {"origin": "*"}})
 
+  # writes by other processes (workers, flask CLI commands) reach the caches
+  # through data_versions, checked at most once per VERSION_CHECK_INTERVAL
+  @app.before_request
+  def check_shared_versions():
+    sync_versions(db.engine, app.config['VERSION_CHECK_INTERVAL'])
+
   # CORS Headers 
   @app.after_request
   def after_request(response):
@@ -35,20 +146,190 @@ def create_app(test_config=None):
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
     return response
 
+  '''
+  Category cache: the id->type dict, the serialized /categories body and its
+  ETag, rebuilt only when the category version changes.
+  '''
+  category_cache = {'entry': None}
+
+  def get_category_cache():
+    entry = category_cache['entry']
+    version = category_version()
+    if entry is None or entry['version'] != version:
+      entry = category_entry(version, Category.query.with_entities(Category.id, Category.type).order_by(Category.id))
+      # swap in a complete entry so concurrent readers never see a partial one
+      category_cache['entry'] = entry
+    return entry
+
+  '''
+  Hot reads: concurrent identical GET /categories and GET /questions
+  requests (same path and args) share one computation and one serialized
+  body, kept for HOT_READ_TTL seconds while the data versions are unchanged.
+  '''
+  hot_reads = SingleFlight(ttl=app.config['HOT_READ_TTL'], max_entries=app.config['HOT_READ_MAX_ENTRIES'])
+  app.extensions['hot_reads'] = hot_reads
+
+  def hot_read_key():
+    return request.path, tuple(sorted(request.args.items(multi=True)))
+
+  quiz_pool = QuizPool()
+  # one request reloads the quiz pool; the others wait for it instead of
+  # each loading every question id after a write
+  pool_lock = threading.Lock()
+  quiz_sessions = QuizSessionStore(
+    max_sessions=app.config['QUIZ_SESSIONS_MAX'],
+    ttl=app.config['QUIZ_SESSION_TTL'],
+    spill_path=app.config['QUIZ_SESSION_SPILL']
+  )
+
+  question_stats = QuestionStats()
+
+  result_recorder = ResultRecorder(
+    app,
+    flush_interval=app.config['RESULTS_FLUSH_INTERVAL'],
+    batch_size=app.config['RESULTS_BATCH_SIZE']
+  )
+  app.extensions['result_recorder'] = result_recorder
+  leaderboard = Leaderboard(size=app.config['LEADERBOARD_SIZE'])
+
+  rooms = RoomRegistry(
+    max_rooms=app.config['ROOMS_MAX'],
+    max_players=app.config['ROOM_PLAYERS_MAX'],
+    ttl=app.config['ROOM_TTL'],
+    sweep_interval=app.config['ROOM_SWEEP_INTERVAL']
+  )
+
+  '''
+  Duplicate index: fingerprints of every question, for near duplicates.
+  Exact duplicates are also refused by the unique questions.text_key, in
+  every process. The first write that needs the index (or create_app, with
+  DUPLICATE_INDEX_PRELOAD) starts a background thread that loads it from
+  its file, checks it against the rows and catches up, so no request pays
+  for fingerprinting the bank. Afterwards it is caught up with the
+  database whenever the question version has moved, including writes other
+  processes publish. Until the first build finishes, writes that need it
+  wait up to DUPLICATE_INDEX_WAIT seconds and then answer 503. The file
+  sits next to a SQLite database (<db>.dedup), otherwise in the instance
+  folder, unless DUPLICATE_INDEX_PATH says where.
+  '''
+  duplicate_index = DuplicateIndex(threshold=app.config['DUPLICATE_THRESHOLD'])
+  duplicate_state = {'path': None, 'builder': None}
+  # serializes the build, refreshes and saves; reentrant because a refresh saves
+  duplicate_lock = threading.RLock()
+  # guards starting the builder only, so waiting requests never queue behind a build
+  builder_lock = threading.Lock()
+  duplicate_ready = threading.Event()
+
+  def duplicate_index_path():
+    path = app.config['DUPLICATE_INDEX_PATH']
+    if path is None:
+      path = default_index_path(db.get_engine(app).url, app.instance_path)
+    return path
+
+  def save_duplicate_index():
+    with duplicate_lock:
+      if duplicate_index.dirty and duplicate_state['path'] is not None:
+        try:
+          duplicate_index.save(duplicate_state['path'])
+        except OSError:
+          app.logger.exception('saving the duplicate index failed')
+
+  def build_duplicate_index():
+    with app.app_context():
+      try:
+        with duplicate_lock:
+          path = duplicate_index_path()
+          if duplicate_index.load(path):
+            duplicate_index.verify(db.session)
+          duplicate_index.refresh(db.session, question_version())
+          duplicate_state['path'] = path
+          save_duplicate_index()
+        atexit.register(save_duplicate_index)
+        duplicate_ready.set()
+      except Exception:
+        # the next request that needs the index starts another build
+        app.logger.exception('building the duplicate index failed')
+
+  def start_duplicate_build():
+    with builder_lock:
+      builder = duplicate_state['builder']
+      if duplicate_ready.is_set() or (builder is not None and builder.is_alive()):
+        return
+      builder = threading.Thread(target=build_duplicate_index, name='duplicate-index', daemon=True)
+      duplicate_state['builder'] = builder
+      builder.start()
+
+  def get_duplicate_index(timeout=None):
+    '''The index caught up with the database, or None if its first build takes longer than timeout seconds.'''
+    if not duplicate_ready.is_set():
+      start_duplicate_build()
+      if not duplicate_ready.wait(timeout):
+        return None
+    version = question_version()
+    if duplicate_index.version != version:
+      with duplicate_lock:
+        if duplicate_index.version != version:
+          duplicate_index.refresh(db.session, version)
+          save_duplicate_index()
+    return duplicate_index
+
+  if app.config['DUPLICATE_INDEX_PRELOAD']:
+    start_duplicate_build()
+
+  answer_cache = AnswerCache(max_size=app.config['ANSWER_CACHE_SIZE'])
+
+  def load_answer(question_id):
+    row = Question.query.with_entities(Question.answer).filter(Question.id == question_id).first()
+    return row[0] if row is not None else None
+
+  def get_answer_key(question_id):
+    return answer_cache.get(question_version(), question_id, load_answer)
+
+  def get_leaderboard():
+    if not leaderboard.loaded:
+      leaderboard.load(db.session)
+    return leaderboard
+
+  def get_question_stats():
+    version = question_version()
+    if question_stats.version != version:
+      question_stats.load(version, db.session.execute(STATS_QUERY))
+    return question_stats
+
+  def get_quiz_pool():
+    if quiz_pool.version != question_version():
+      with pool_lock:
+        version = question_version()
+        if quiz_pool.version != version:
+          quiz_pool.load(version, Question.query.with_entities(
+            Question.id, Question.category, Question.difficulty).order_by(Question.id))
+    return quiz_pool
+
+  def pick_quiz_question(category_id, seen, difficulty=None):
+    '''
+    (version, row) for an unseen question, or None when none are left. An id
+    whose row is gone (deleted by another process since the pool loaded)
+    reloads the pool and picks again.
+    '''
+    for _ in range(MAX_STALE_PICKS):
+      version = question_version()
+      question_id = get_quiz_pool().pick(category_id, seen, difficulty)
+      if question_id is None:
+        return None
+      row = Question.query.with_entities(*QUESTION_COLUMNS).filter(Question.id == question_id).first()
+      if row is not None:
+        return version, format_question_row(row)
+      touch_version(Question)
+    abort(503)
+
   @app.route('/categories')
   def get_categories():
     try:
-      data = Category.query.order_by(Category.id).all()
-
-      categories = {}
-      for category in data:
-        categories[category.id] = category.type
-
-      return jsonify({
-        'success': True,
-        'categories': categories,
-        'total_categories': len(categories)
-      })
+      cache = hot_reads.do(hot_read_key(), category_version(), get_category_cache)
+      response = app.response_class(cache['body'], mimetype='application/json')
+      response.set_etag(cache['etag'])
+      response.headers['Cache-Control'] = 'public, no-cache'
+      return response.make_conditional(request)
     except:
       abort(500)
 
@@ -66,28 +347,30 @@ def create_app(test_config=None):
   '''
   @app.route('/questions')
   def get_questions():
-
-    #get questions
-    questions = Question.query.order_by(Question.id).all()
-    total_questions = len(questions)
-    current_questions = paginate_questions(request, questions)
+    body = hot_reads.do(hot_read_key(), (question_version(), category_version()), questions_page_body)
 
     # abort 404 if no questions
-    if (len(current_questions) == 0):
+    if body is None:
         abort(404)
 
+    return app.response_class(body, mimetype='application/json')
+
+  def questions_page_body():
+    #get a page of questions and the total count
+    current_questions = paginate_questions(request, Question.query)
+    if (len(current_questions) == 0):
+        return None
+    total_questions = count_questions(Question.query)
+
     #get categories
-    data = Category.query.order_by(Category.id).all()
-    categories = {}
-    for category in data:
-      categories[category.id] = category.type
+    categories = get_category_cache()['categories']
 
     return jsonify({
         'success': True,
         'questions': current_questions,
         'total_questions': total_questions,
         'categories': categories
-    })
+    }).get_data()
 
   '''
   @DONE: 
@@ -104,7 +387,16 @@ def create_app(test_config=None):
       if question is None:
         abort(404)
 
+      # still building: the build or the next refresh drops the row instead
+      index = get_duplicate_index(timeout=0)
+      before = question_version()
       question.delete()
+      after = question_version()
+      question_stats.adjust(before, after, question.category, question.difficulty, -1)
+      if index is not None:
+        index.remove(id)
+        index.advance(before, after)
+      answer_cache.advance(before, after, removed=id)
       
       return jsonify({
         'success': True,
@@ -125,6 +417,11 @@ def create_app(test_config=None):
   '''
   @app.route('/questions', methods=['POST'])
   def create_question():
+    # the duplicate check needs the index; 503 while its first build runs
+    index = get_duplicate_index(timeout=app.config['DUPLICATE_INDEX_WAIT'])
+    if index is None:
+      abort(503)
+
     try:
 
       data = request.get_json()
@@ -137,6 +434,24 @@ def create_app(test_config=None):
       if (question == None or question == '' or answer == None or answer == '' or category == None or category == ''  or difficulty == None or difficulty == ''):
         abort(422)
 
+      # category must be the id of an existing category
+      category = int(category)
+      if category not in get_category_cache()['categories']:
+        abort(422)
+
+      # exact repeats are always refused; near duplicates unless the client
+      # confirms with allow_duplicate
+      fingerprint = fingerprint_text(question)
+      match = index.find(fingerprint)
+      if match is not None and (match[2] or not data.get('allow_duplicate')):
+        return jsonify({
+          'success': False,
+          'error': 409,
+          'message': 'Duplicate question.',
+          'duplicate_of': match[0],
+          'similarity': match[1]
+        }), 409
+
       question = Question(
         question = question,
         answer = answer,
@@ -144,7 +459,28 @@ def create_app(test_config=None):
         difficulty=difficulty
       )
 
-      question.insert()
+      before = question_version()
+      try:
+        question.insert()
+      except IntegrityError:
+        # an exact duplicate stored by a process this index has not caught up with
+        db.session.rollback()
+        original = Question.query.with_entities(Question.id) \
+          .filter(Question.text_key == question_key(question.question)).first()
+        if original is None:
+          raise
+        return jsonify({
+          'success': False,
+          'error': 409,
+          'message': 'Duplicate question.',
+          'duplicate_of': original[0],
+          'similarity': 1.0
+        }), 409
+      after = question_version()
+      question_stats.adjust(before, after, question.category, question.difficulty, 1)
+      index.add(question.id, fingerprint)
+      index.advance(before, after)
+      answer_cache.advance(before, after)
     
       return jsonify({
           "success": True,
@@ -154,6 +490,47 @@ def create_app(test_config=None):
     except:
       abort(422)
 
+  '''
+  Bulk import: the body is NDJSON, one question object per line, read as a
+  stream. Valid lines are inserted in batches; invalid ones are reported.
+  '''
+  @app.route('/questions/bulk', methods=['POST'])
+  def bulk_create_questions():
+    duplicates = get_duplicate_index(timeout=app.config['DUPLICATE_INDEX_WAIT'])
+    if duplicates is None:
+      abort(503)
+
+    try:
+      inserted, error_count, errors = import_questions(
+        request.stream, get_category_cache()['categories'], duplicates=duplicates)
+    except ImportFailed as e:
+      # earlier batches are committed: say how far the import got
+      return jsonify({
+        'success': False,
+        'error': 422,
+        'message': 'Unable to process. Invalid input...',
+        'inserted': e.inserted,
+        'failed_line': e.line
+      }), 422
+    except:
+      db.session.rollback()
+      abort(422)
+
+    return jsonify({
+      'success': True,
+      'inserted': inserted,
+      'total_errors': error_count,
+      'errors': errors
+    })
+
+  @app.route('/questions/export')
+  def export_all_questions():
+    return Response(
+      stream_with_context(export_questions()),
+      mimetype='application/x-ndjson',
+      headers={'Content-Disposition': 'attachment; filename=questions.ndjson'}
+    )
+
   '''
   @DONE: 
   Create a POST endpoint to get questions based on a search term. 
@@ -169,22 +546,59 @@ def create_app(test_config=None):
     data = request.get_json()
 
     #search_term = 'Africa'
-    if(data['searchTerm']):
-      search_term = data['searchTerm']
+    search_term = data.get('searchTerm') if data else None
+    if not search_term:
+      abort(422)
 
-    questions = Question.query.filter(Question.question.ilike('%{}%'.format(search_term))).all()
-    
-    if questions==[]:
-      abort(404)
+    if data.get('ranked'):
+      # full-text mode: relevance ordered, LIMIT/OFFSET paged
+      page = request.args.get('page', 1, type=int)
+      if page < 1:
+        abort(404)
+      current_questions, total_questions = ranked_search(
+        db.session, search_term, page, QUESTIONS_PER_PAGE, highlight=bool(data.get('highlight')))
+
+      if current_questions==[]:
+        abort(404)
+
+      return jsonify({
+        'success': True,
+        'questions': current_questions,
+        'total_questions': total_questions
+      })
 
+    questions = Question.query.filter(Question.question.ilike('%{}%'.format(search_term)))
     current_questions = paginate_questions(request, questions)
 
+    if current_questions==[]:
+      abort(404)
+
     return jsonify({
       'success': True,
       'questions': current_questions,
-      'total_questions': len(current_questions)
+      'total_questions': count_questions(questions)
     })
 
+  '''
+  Question counts per category and difficulty, served from counts that
+  create_question and delete_question keep up to date.
+  '''
+  @app.route('/stats')
+  def get_stats():
+    stats = get_question_stats().summary(get_category_cache()['categories'])
+    stats['success'] = True
+    return jsonify(stats)
+
+  '''
+  Hit counters for the hot-read layer: hits were served a kept body,
+  shared waited for a concurrent identical request, misses ran the queries.
+  '''
+  @app.route('/stats/hot-reads')
+  def get_hot_read_stats():
+    metrics = hot_reads.metrics()
+    metrics['success'] = True
+    return jsonify(metrics)
+
   '''
   @DONE: 
   Create a GET endpoint to get questions based on category. 
@@ -201,7 +615,7 @@ def create_app(test_config=None):
       abort(404)
 
     try:
-      questions = Question.query.filter_by(category=category.id).all()
+      questions = Question.query.filter_by(category=category.id)
       
       current_questions = paginate_questions(request, questions)
 
@@ -209,7 +623,7 @@ def create_app(test_config=None):
         'success': True,
         'questions': current_questions,
         'current_category': category.type,
-        'total_questions': len(questions)
+        'total_questions': count_questions(questions)
       })
     except:
       abort(500)
@@ -229,31 +643,345 @@ def create_app(test_config=None):
   def get_quiz_question():
 
     data = request.get_json()
-    category = data['quiz_category']
-    previous_questions = data['previous_questions']
-
-    if ((category is None) or (previous_questions is None)):
+    # answers are scored by /quizzes/answer only, never from a client's own verdict
+    if data is None or 'correct' in data:
       abort(422)
 
-    if category['id'] != 0:
-      questions = Question.query.filter(Question.category == category['id']).all()
+    session_id = data.get('quiz_session')
+    if session_id is not None:
+      # continue a server-side session: category and seen ids are kept here
+      session = quiz_sessions.get(session_id)
+      if session is None:
+        abort(404)
+      category_id = session.category_id
+      seen = session.seen
     else:
-      questions = Question.query.all()
+      category = data.get('quiz_category')
+      if category is None:
+        abort(422)
+      try:
+        category_id = int(category['id'])
+      except (KeyError, TypeError, ValueError):
+        abort(422)
+
+      if 'previous_questions' in data:
+        # stateless mode: the client sends every question it has seen
+        seen = valid_question_ids(data['previous_questions'])
+        if seen is None:
+          abort(422)
+      else:
+        # no history sent: start a new session, optionally adaptive
+        difficulty = START_DIFFICULTY if data.get('adaptive') else None
+        session_id = quiz_sessions.create(category_id, difficulty=difficulty, player=valid_player(data.get('player')))
+        session = quiz_sessions.get(session_id)
+        seen = session.seen
 
-    if(len(questions) == len(previous_questions)):
+    difficulty = session.difficulty if session_id is not None else None
+    picked = pick_quiz_question(category_id, seen, difficulty)
+
+    if picked is None:
       return jsonify({
         'success': True,
         'message': "game over"
         })
     
-    rem_questions = [question for question in questions if question.id not in previous_questions]
-    next_question = random.choice(rem_questions).format()
-
-    return jsonify({
+    version, next_question = picked
+    question_id = next_question['id']
+    # the answer is already loaded: have it ready for /quizzes/answer
+    answer_cache.put(version, question_id, next_question['answer'])
+    if data.get('hide_answer'):
+      del next_question['answer']
+    response = {
         "success": True,
         "question": next_question
+    }
+    if session_id is not None:
+      seen.add(question_id)
+      session.last_question = question_id
+      response['quiz_session'] = session_id
+      if difficulty is not None:
+        response['difficulty'] = difficulty
+
+    return jsonify(response)
+
+  '''
+  Check an answer on the server: the submission is compared with the
+  question's cached, normalized answer, forgiving case, punctuation,
+  articles, number words and a few typos. The correct answer is returned
+  with the verdict. Within a session, the first answer to the question
+  last served is scored; this is the only way a session's score moves.
+  '''
+  @app.route('/quizzes/answer', methods=['POST'])
+  def check_quiz_answer():
+    data = request.get_json()
+    if data is None:
+      abort(422)
+    guess = data.get('answer')
+    try:
+      question_id = int(data['question_id'])
+    except (KeyError, TypeError, ValueError):
+      abort(422)
+    if not isinstance(guess, str):
+      abort(422)
+
+    session = None
+    if data.get('quiz_session') is not None:
+      session = quiz_sessions.get(data['quiz_session'])
+      if session is None:
+        abort(404)
+
+    key = get_answer_key(question_id)
+    if key is None:
+      abort(404)
+    correct = key.matches(guess)
+
+    if session is not None:
+      if session.last_question == question_id:
+        session.record(correct)
+        session.last_question = None
+        result_recorder.record_outcome(question_id, correct, session.player)
+    else:
+      result_recorder.record_outcome(question_id, correct, valid_player(data.get('player')))
+
+    return jsonify({
+      'success': True,
+      'question_id': question_id,
+      'correct': correct,
+      'answer': key.answer
+    })
+
+  '''
+  Finish a quiz session and record its score, as tallied from the answers
+  checked by /quizzes/answer; the session is closed. A score or total sent
+  by the client is refused. The write is buffered; the leaderboard
+  reflects the result immediately.
+  '''
+  @app.route('/quizzes/results', methods=['POST'])
+  def record_quiz_result():
+    data = request.get_json()
+    if data is None or data.get('quiz_session') is None or 'score' in data or 'total' in data:
+      abort(422)
+
+    session_id = data['quiz_session']
+    session = quiz_sessions.get(session_id)
+    if session is None:
+      abort(404)
+    player = valid_player(data.get('player', session.player))
+    category_id, score, total = session.category_id, session.score, session.answered
+
+    if player is None:
+      abort(422)
+
+    result_recorder.record_result(player, category_id, score, total)
+    rank = get_leaderboard().offer(category_id, player, score)
+    if session_id is not None:
+      quiz_sessions.discard(session_id)
+
+    return jsonify({
+      'success': True,
+      'player': player,
+      'score': score,
+      'total': total,
+      'rank': rank
+    })
+
+  @app.route('/leaderboard')
+  def get_leaderboard_page():
+    category_id = request.args.get('category', 0, type=int)
+    limit = request.args.get('limit', app.config['LEADERBOARD_SIZE'], type=int)
+    if limit < 1:
+      abort(422)
+
+    return jsonify({
+      'success': True,
+      'category': category_id,
+      'leaders': get_leaderboard().top(category_id, limit)
+    })
+
+  '''
+  Multiplayer rooms: players share a room code and see the same questions.
+  Every change is pushed to GET /rooms/<code>/events as a Server-Sent Event
+  carrying the room's full state. The host moves the room to the next
+  question, and each player submits an answer, checked on the server.
+  Questions are sent without their answers.
+  '''
+  def get_room(code):
+    room = rooms.get(code)
+    if room is None:
+      abort(404)
+    return room
+
+  def room_player(data):
+    player = valid_player(data.get('player')) if data else None
+    if player is None:
+      abort(422)
+    return player
+
+  def pick_room_question(category_id, seen):
+    picked = pick_quiz_question(category_id, seen)
+    if picked is None:
+      return None
+    question = picked[1]
+    # the room's state goes to every player; answers are only checked on the server
+    del question['answer']
+    return question
+
+  @app.route('/rooms', methods=['POST'])
+  def create_room():
+    data = request.get_json()
+    player = room_player(data)
+    try:
+      category_id = int(data['quiz_category']['id'])
+    except (KeyError, TypeError, ValueError):
+      abort(422)
+    if category_id != 0 and category_id not in get_category_cache()['categories']:
+      abort(422)
+
+    room = rooms.create(category_id, player)
+    if room is None:
+      abort(503)
+
+    return jsonify({
+      'success': True,
+      'room': room.snapshot()
+    })
+
+  @app.route('/rooms/<code>')
+  def get_room_state(code):
+    return jsonify({
+      'success': True,
+      'room': get_room(code).snapshot()
+    })
+
+  @app.route('/rooms/<code>/join', methods=['POST'])
+  def join_room(code):
+    room = get_room(code)
+    if not rooms.join(room, room_player(request.get_json())):
+      abort(422)
+    return jsonify({
+      'success': True,
+      'room': room.snapshot()
+    })
+
+  @app.route('/rooms/<code>/leave', methods=['POST'])
+  def leave_room(code):
+    room = get_room(code)
+    rooms.leave(room, room_player(request.get_json()))
+    return jsonify({
+      'success': True
+    })
+
+  @app.route('/rooms/<code>/next', methods=['POST'])
+  def next_room_question(code):
+    room = get_room(code)
+    if room_player(request.get_json()) != room.host or room.finished:
+      abort(422)
+    question = rooms.next_question(room, pick_room_question)
+    return jsonify({
+      'success': True,
+      'question': question
     })
 
+  @app.route('/rooms/<code>/answer', methods=['POST'])
+  def answer_room_question(code):
+    room = get_room(code)
+    data = request.get_json()
+    player = room_player(data)
+    current = room.question
+    if current is None or not isinstance(data.get('answer'), str):
+      abort(422)
+    # checked on the server, like /quizzes/answer
+    key = get_answer_key(current['id'])
+    if key is None:
+      abort(422)
+    correct = key.matches(data['answer'])
+    question = rooms.answer(room, player, current['id'], correct)
+    if question is None:
+      abort(422)
+    result_recorder.record_outcome(question['id'], correct, player)
+    return jsonify({
+      'success': True,
+      'correct': correct,
+      'answer': key.answer,
+      'score': room.players.get(player)
+    })
+
+  @app.route('/rooms/<code>/events')
+  def room_events(code):
+    room = get_room(code)
+    # a reconnecting EventSource resumes from the last event it saw
+    cursor = request.headers.get('Last-Event-ID', type=int)
+    heartbeat = app.config['ROOM_HEARTBEAT']
+
+    def stream():
+      position = cursor
+      while True:
+        batch = rooms.events(room, position, heartbeat)
+        if batch is None:
+          return
+        events, new_position = batch
+        if not events:
+          # SSE comment line: keeps proxies from closing an idle stream
+          yield ': keepalive\n\n'
+        for event in events:
+          yield event
+        position = new_position
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+      'Cache-Control': 'no-cache',
+      'X-Accel-Buffering': 'no'
+    })
+
+  @app.cli.command('migrate-category')
+  @click.option('--batch-size', default=10000, help='Rows backfilled per transaction.')
+  def migrate_category_command(batch_size):
+    """Convert questions.category to an indexed integer foreign key."""
+    migrate_question_category(db.engine, batch_size)
+
+  @app.cli.command('import-questions')
+  @click.argument('source', type=click.File('r'))
+  @click.option('--batch-size', default=1000, help='Rows inserted per transaction.')
+  def import_questions_command(source, batch_size):
+    """Import questions from an NDJSON file ('-' for stdin)."""
+    try:
+      inserted, error_count, errors = import_questions(
+        source, get_category_cache()['categories'], batch_size, duplicates=get_duplicate_index())
+    except ImportFailed as e:
+      raise click.ClickException('{}; {} questions were imported before it'.format(e, e.inserted))
+    for error in errors:
+      click.echo('line {line}: {error}'.format(**error), err=True)
+    click.echo('{} questions imported, {} lines rejected'.format(inserted, error_count))
+
+  @app.cli.command('rebuild-duplicate-index')
+  def rebuild_duplicate_index_command():
+    """Fingerprint every question again and rewrite the duplicate index file."""
+    path = duplicate_index_path()
+    index = DuplicateIndex(threshold=app.config['DUPLICATE_THRESHOLD'])
+    index.refresh(db.session, question_version())
+    index.save(path)
+    click.echo('{} questions indexed in {}'.format(len(index), path))
+
+  @app.cli.command('calibrate-difficulty')
+  @click.option('--min-attempts', default=30, help='Answers a question needs before its difficulty is changed.')
+  @click.option('--prior-weight', default=1.0, help='How strongly fitted difficulties are pulled to the authored ones.')
+  @click.option('--dry-run', is_flag=True, help='Report the changes without writing them.')
+  def calibrate_difficulty_command(min_attempts, prior_weight, dry_run):
+    """Refit question difficulties (1-5) from recorded answer outcomes; needs NumPy."""
+    # NumPy is only needed here, so it stays out of the app's imports
+    from .calibration import calibrate_difficulty
+    fitted, changes = calibrate_difficulty(min_attempts, prior_weight, dry_run)
+    for question_id, old, new in changes:
+      click.echo('question {}: difficulty {} -> {}'.format(question_id, old, new))
+    click.echo('{} questions fitted, {} difficulties {}'.format(
+      fitted, len(changes), 'would change' if dry_run else 'changed'))
+
+  @app.cli.command('export-questions')
+  @click.argument('target', type=click.File('w'))
+  def export_questions_command(target):
+    """Export every question as NDJSON ('-' for stdout)."""
+    for chunk in export_questions():
+      target.write(chunk)
+
   '''
   @DONE: 
   Create error handlers for all expected errors 
@@ -275,6 +1003,14 @@ def create_app(test_config=None):
       'message': 'Resource not found.'
     }), 404
 
+  @app.errorhandler(409)
+  def conflict(error):
+    return jsonify({
+      'success': False,
+      'error': 409,
+      'message': 'Duplicate question.'
+    }), 409
+
   @app.errorhandler(422)
   def unprocessable(error):
     return jsonify({
@@ -283,6 +1019,14 @@ def create_app(test_config=None):
       'message': 'Unable to process. Invalid input...'
     }), 422
 
+  @app.errorhandler(503)
+  def service_unavailable(error):
+    return jsonify({
+      'success': False,
+      'error': 503,
+      'message': 'Service unavailable. Please try later...'
+    }), 503
+
   @app.errorhandler(500)
   def internal_server_error(error):
       return jsonify({
@@ -0,0 +1,195 @@
+'''
+Server-side answer checking for POST /quizzes/answer.
+
+Answers are normalized once (case, accents, punctuation, articles, number
+words) and cached per question id, so checking a submission costs one
+normalization of the guess and a bounded edit-distance comparison.
+'''
+import threading
+from collections import OrderedDict
+
+from .dedup import normalize_text
+
+ARTICLES = frozenset(('a', 'an', 'the'))
+
+UNITS = ('zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten',
+         'eleven', 'twelve', 'thirteen', 'fourteen', 'fifteen', 'sixteen', 'seventeen',
+         'eighteen', 'nineteen', 'twenty')
+TENS = ('thirty', 'forty', 'fifty', 'sixty', 'seventy', 'eighty', 'ninety')
+ORDINALS = ('first', 'second', 'third', 'fourth', 'fifth', 'sixth', 'seventh', 'eighth', 'ninth', 'tenth')
+
+NUMBER_WORDS = dict((word, value) for value, word in enumerate(UNITS))
+NUMBER_WORDS.update((word, 30 + 10 * i) for i, word in enumerate(TENS))
+ORDINAL_WORDS = dict((word, '{}{}'.format(i, ('st', 'nd', 'rd')[i - 1] if i < 4 else 'th'))
+                     for i, word in enumerate(ORDINALS, 1))
+
+def normalize_answer(text):
+  '''
+  normalize_text(), then drop articles and write numbers as digits:
+  "The Twenty-One" -> "21", "1,000" -> "1000", "third" -> "3rd".
+  '''
+  words = []
+  # words[-1] is a tens number that a following unit may complete
+  open_tens = False
+  for word in normalize_text(text).split():
+    if word in ARTICLES:
+      continue
+    if word in NUMBER_WORDS:
+      value = NUMBER_WORDS[word]
+      if open_tens and 0 < value < 10:
+        words[-1] = str(int(words[-1]) + value)
+        open_tens = False
+        continue
+      words.append(str(value))
+      open_tens = value >= 20 and value % 10 == 0
+      continue
+    open_tens = False
+    if word in ORDINAL_WORDS:
+      words.append(ORDINAL_WORDS[word])
+    elif len(word) == 3 and word.isdigit() and words and words[-1].isdigit():
+      # thousands separators were split off as punctuation
+      words[-1] += word
+    else:
+      words.append(word)
+  return ' '.join(words)
+
+
+def allowed_edits(length):
+  '''Typos forgiven for an answer of this many characters.'''
+  if length <= 3:
+    return 0
+  if length <= 7:
+    return 1
+  if length <= 14:
+    return 2
+  return 3
+
+
+def within_edits(a, b, limit):
+  '''
+  True if the Levenshtein distance between a and b is at most limit. A
+  shared prefix and suffix are skipped, only the band of cells within limit
+  of the diagonal is computed, and the scan stops at the first row whose
+  cells all exceed limit.
+  '''
+  if a == b:
+    return True
+  if abs(len(a) - len(b)) > limit:
+    return False
+  start = 0
+  while start < len(a) and start < len(b) and a[start] == b[start]:
+    start += 1
+  end = 0
+  while end < len(a) - start and end < len(b) - start and a[-1 - end] == b[-1 - end]:
+    end += 1
+  a, b = a[start:len(a) - end], b[start:len(b) - end]
+  if len(a) > len(b):
+    a, b = b, a
+  over = limit + 1
+  previous = [j if j <= limit else over for j in range(len(b) + 1)]
+  for i in range(1, len(a) + 1):
+    char = a[i - 1]
+    current = [over] * (len(b) + 1)
+    if i <= limit:
+      current[0] = i
+    best = current[0]
+    for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+      value = min(previous[j - 1] + (char != b[j - 1]), previous[j] + 1, current[j - 1] + 1)
+      if value < over:
+        current[j] = value
+        if value < best:
+          best = value
+    if best > limit:
+      return False
+    previous = current
+  return previous[len(b)] <= limit
+
+'''
+AnswerKey
+    a question's answer prepared for matching: the normalized text, its
+    last word (a surname, say, for a multi-word answer), the numbers it
+    contains, and how many typos it forgives.
+'''
+class AnswerKey(object):
+  __slots__ = ('answer', 'normalized', 'last_word', 'numbers', 'edits')
+
+  def __init__(self, answer):
+    self.answer = answer
+    self.normalized = normalize_answer(answer)
+    words = self.normalized.split()
+    self.numbers = [word for word in words if word.isdigit()]
+    self.last_word = words[-1] if len(words) > 1 and not words[-1].isdigit() else None
+    self.edits = allowed_edits(len(self.normalized))
+
+  def matches(self, guess):
+    '''
+    True if the guess is the answer (or, for a multi-word answer, its last
+    word) up to typos. Numbers must match exactly.
+    '''
+    guess = normalize_answer(guess)
+    if not guess:
+      return False
+    if guess == self.normalized:
+      return True
+    if [word for word in guess.split() if word.isdigit()] != self.numbers:
+      return False
+    if within_edits(guess, self.normalized, self.edits):
+      return True
+    return self.last_word is not None and \
+      within_edits(guess, self.last_word, allowed_edits(len(self.last_word)))
+
+'''
+AnswerCache
+    question id -> AnswerKey for the most recently used max_size questions.
+    Entries are tied to the question version. create_question and
+    delete_question move the version on with advance(); any other write
+    clears the cache on the next lookup.
+'''
+class AnswerCache(object):
+
+  def __init__(self, max_size=10000):
+    self.max_size = max_size
+    self.lock = threading.Lock()
+    self.version = None
+    self.entries = OrderedDict()
+
+  def get(self, version, question_id, load):
+    '''The AnswerKey for question_id; load(question_id) returns the answer text (or None) on a miss.'''
+    key = self.lookup(version, question_id)
+    if key is not None:
+      return key
+    answer = load(question_id)
+    if answer is None:
+      return None
+    return self.put(version, question_id, answer)
+
+  def lookup(self, version, question_id):
+    '''The cached AnswerKey for question_id, or None; for callers that load answers asynchronously.'''
+    with self.lock:
+      if self.version != version:
+        self.entries.clear()
+        self.version = version
+      key = self.entries.get(question_id)
+      if key is not None:
+        self.entries.move_to_end(question_id)
+      return key
+
+  def put(self, version, question_id, answer):
+    key = AnswerKey(answer)
+    with self.lock:
+      if self.version == version:
+        self.entries[question_id] = key
+        self.entries.move_to_end(question_id)
+        if len(self.entries) > self.max_size:
+          self.entries.popitem(last=False)
+    return key
+
+  def advance(self, before, after, removed=None):
+    '''Follow one create or delete (removed: the deleted id) that moved the version from before to after.'''
+    with self.lock:
+      if self.version == before and after == before + 1:
+        self.entries.pop(removed, None)
+        self.version = after
+
+  def __len__(self):
+    return len(self.entries)
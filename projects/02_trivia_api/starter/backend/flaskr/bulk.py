@@ -0,0 +1,150 @@
+'''
+Streaming NDJSON import and export of the question bank.
+
+Imports parse one JSON object per line, validate it, and insert valid rows
+in batches of executemany INSERTs, one transaction per batch; invalid lines
+are skipped and reported with their line number. Exports read through a
+server-side cursor in fixed chunks, so neither direction holds the whole
+bank in memory.
+'''
+import json
+
+from models import db, Question, publish_versions
+from .dedup import DuplicateIndex, fingerprint_text, question_key
+
+EXPORT_COLUMNS = ('id', 'question', 'answer', 'category', 'difficulty')
+EXPORT_CHUNK_SIZE = 1000
+# errors returned to the caller; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+def validate_question(data, categories):
+  if not isinstance(data, dict):
+    raise ValueError('expected a JSON object')
+  for field in ('question', 'answer', 'category', 'difficulty'):
+    if data.get(field) is None or data.get(field) == '':
+      raise ValueError('missing {}'.format(field))
+  try:
+    category = int(data['category'])
+    difficulty = int(data['difficulty'])
+  except (TypeError, ValueError):
+    raise ValueError('category and difficulty must be integers')
+  if category not in categories:
+    raise ValueError('unknown category {}'.format(category))
+  return {
+    'question': str(data['question']),
+    'answer': str(data['answer']),
+    'category': category,
+    'difficulty': difficulty,
+    # Core inserts skip the ORM event that sets it
+    'text_key': question_key(str(data['question']))
+  }
+
+'''
+ImportFailed
+    an import stopped by a database error. inserted rows were committed by
+    earlier batches; line is the first line that was not committed, so the
+    import can be resumed from there.
+'''
+class ImportFailed(Exception):
+
+  def __init__(self, inserted, line, error):
+    super().__init__('import failed at line {}: {}'.format(line, error))
+    self.inserted = inserted
+    self.line = line
+
+def check_duplicate(data, fingerprint, duplicates, earlier_lines):
+  '''Raise ValueError if the question repeats the bank or an earlier line of the import.'''
+  for index, label in ((duplicates, 'question'), (earlier_lines, 'line')):
+    match = index.find(fingerprint)
+    if match is None:
+      continue
+    match_id, score, exact = match
+    if exact:
+      raise ValueError('duplicate of {} {}'.format(label, match_id))
+    if not data.get('allow_duplicate'):
+      raise ValueError('near duplicate of {} {} (similarity {:.2f})'.format(label, match_id, score))
+
+'''
+import_questions(lines, categories, batch_size, duplicates=None)
+    inserts the valid NDJSON lines and returns (inserted, error_count, errors).
+    Raises ImportFailed if a batch cannot be written.
+    With a DuplicateIndex, lines repeating a question already in the bank or
+    earlier in the import are rejected (near duplicates only unless the line
+    sets allow_duplicate), and the index is updated with the inserted rows.
+'''
+def import_questions(lines, categories, batch_size=1000, duplicates=None):
+  inserted = 0
+  error_count = 0
+  errors = []
+  batch = []
+  # line number of the batch's first line
+  batch_line = None
+  number = 0
+  # fingerprints of this import's rows, by line number and by exact key
+  earlier_lines = DuplicateIndex(duplicates.threshold) if duplicates is not None else None
+  pending = {}
+
+  def flush():
+    nonlocal inserted, batch_line
+    db.session.execute(Question.__table__.insert(), batch)
+    db.session.commit()
+    inserted += len(batch)
+    batch.clear()
+    batch_line = None
+    if duplicates is not None:
+      # index the new ids, reusing the fingerprints computed while checking
+      duplicates.refresh(db.session, duplicates.version, pending)
+      pending.clear()
+
+  try:
+    for number, line in enumerate(lines, 1):
+      if not line.strip():
+        continue
+      try:
+        data = json.loads(line)
+        row = validate_question(data, categories)
+        if duplicates is not None:
+          fingerprint = fingerprint_text(row['question'])
+          check_duplicate(data, fingerprint, duplicates, earlier_lines)
+          earlier_lines.add(number, fingerprint)
+          pending[fingerprint[0]] = fingerprint
+        if not batch:
+          batch_line = number
+        batch.append(row)
+      except ValueError as e:
+        # json.JSONDecodeError is a ValueError too
+        error_count += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+          errors.append({'line': number, 'error': str(e)})
+        continue
+      if len(batch) == batch_size:
+        flush()
+    if batch:
+      flush()
+  except Exception as e:
+    db.session.rollback()
+    raise ImportFailed(inserted, batch_line or number + 1, e) from e
+  finally:
+    if inserted:
+      # core inserts skip the ORM events; publishing tells the running servers too
+      publish_versions(db.session.get_bind(), [Question])
+
+  return inserted, error_count, errors
+
+'''
+export_questions(query)
+    yields NDJSON chunks for a query over the EXPORT_COLUMNS.
+'''
+def export_questions(query=None):
+  if query is None:
+    query = db.session.query(*[getattr(Question, column) for column in EXPORT_COLUMNS])
+  query = query.order_by(Question.id).execution_options(stream_results=True).yield_per(EXPORT_CHUNK_SIZE)
+
+  chunk = []
+  for row in query:
+    chunk.append(json.dumps(dict(zip(EXPORT_COLUMNS, row))))
+    if len(chunk) == EXPORT_CHUNK_SIZE:
+      yield '\n'.join(chunk) + '\n'
+      chunk = []
+  if chunk:
+    yield '\n'.join(chunk) + '\n'
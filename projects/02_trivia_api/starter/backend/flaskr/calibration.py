@@ -0,0 +1,155 @@
+'''
+Difficulty calibration from recorded answer outcomes.
+
+Answers are fitted with a Rasch (one-parameter IRT) model: a player of
+ability theta answers a question of difficulty b correctly with probability
+1 / (1 + exp(b - theta)). Outcomes are aggregated per (question, player) in
+SQL and loaded into NumPy arrays. The fit alternates vectorized Newton steps
+for every question and every player at once (np.bincount sums the
+per-group terms), so its cost grows with the number of groups, with no
+Python loop per question or answer. Each question's authored difficulty is
+the prior mean of its b, so thinly answered questions stay near it.
+Anonymous answers share a fixed ability of 0.
+
+Needs NumPy (pip install numpy); only `flask calibrate-difficulty` imports
+this module.
+'''
+from itertools import chain
+
+import numpy as np
+from sqlalchemy import bindparam, case, func, literal, select
+
+from models import db, Question, AnswerOutcome, publish_versions
+
+DIFFICULTY_LEVELS = np.arange(1, 6)
+# b for each difficulty level: a player of ability 0 answers a level 1
+# question correctly 88% of the time, level 3 50%, level 5 12%
+LEVEL_LOGITS = np.array([-2.0, -1.0, 0.0, 1.0, 2.0])
+LEVEL_CUTOFFS = (LEVEL_LOGITS[1:] + LEVEL_LOGITS[:-1]) / 2
+FETCH_SIZE = 50000
+UPDATE_BATCH_SIZE = 1000
+
+'''
+load_outcomes(connection)
+    (question_ids, player_codes, attempts, correct) arrays with one entry
+    per (question, player). Players are numbered 0..n-1 in SQL. Anonymous
+    answers are grouped per question, with player code -1.
+'''
+def load_outcomes(connection):
+  attempts = func.count(AnswerOutcome.id)
+  correct = func.sum(case([(AnswerOutcome.correct, 1)], else_=0))
+  named = select([
+    AnswerOutcome.question_id,
+    func.dense_rank().over(order_by=AnswerOutcome.player) - 1,
+    attempts,
+    correct
+  ]).where(AnswerOutcome.player.isnot(None)).group_by(AnswerOutcome.question_id, AnswerOutcome.player)
+  anonymous = select([AnswerOutcome.question_id, literal(-1), attempts, correct]) \
+    .where(AnswerOutcome.player.is_(None)).group_by(AnswerOutcome.question_id)
+
+  chunks = []
+  for query in (named, anonymous):
+    result = connection.execution_options(stream_results=True).execute(query)
+    while True:
+      rows = result.fetchmany(FETCH_SIZE)
+      if not rows:
+        break
+      # flattening beats np.array() over result rows by an order of magnitude
+      chunks.append(np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=len(rows) * 4).reshape(-1, 4))
+  table = np.concatenate(chunks) if chunks else np.empty((0, 4), dtype=np.int64)
+  return table[:, 0], table[:, 1], table[:, 2].astype(float), table[:, 3].astype(float)
+
+
+def level_logits(difficulty):
+  '''Prior b for authored difficulties; levels outside 1-5 (or missing) count as 3.'''
+  difficulty = np.asarray(difficulty, dtype=float)
+  known = np.isin(difficulty, DIFFICULTY_LEVELS)
+  index = np.where(known, difficulty, 3).astype(int) - 1
+  return LEVEL_LOGITS[index]
+
+
+def logits_to_levels(b):
+  return np.digitize(b, LEVEL_CUTOFFS) + 1
+
+'''
+fit_rasch(question_index, player_index, attempts, correct, prior_b, ...)
+    the posterior mode of each question's b and each player's ability.
+    question_index and player_index are dense 0-based indexes (player -1 is
+    anonymous, ability fixed at 0); prior_b holds each question's prior
+    mean. prior_weight is the precision of those priors and of the
+    abilities' N(0, 1/prior_weight) prior. Steps are capped at 1 logit.
+'''
+def fit_rasch(question_index, player_index, attempts, correct, prior_b,
+              prior_weight=1.0, iterations=50, tolerance=1e-4):
+  n_questions = len(prior_b)
+  n_players = int(player_index.max()) + 1 if len(player_index) else 0
+  b = np.array(prior_b, dtype=float)
+  # the last slot is the anonymous player
+  theta = np.zeros(n_players + 1)
+  player_slot = np.where(player_index < 0, n_players, player_index)
+
+  def residuals():
+    p = 1.0 / (1.0 + np.exp(b[question_index] - theta[player_slot]))
+    return correct - attempts * p, attempts * p * (1.0 - p)
+
+  for _ in range(iterations):
+    residual, information = residuals()
+    gradient = -np.bincount(question_index, residual, n_questions) - prior_weight * (b - prior_b)
+    step_b = np.clip(gradient / (np.bincount(question_index, information, n_questions) + prior_weight), -1, 1)
+    b += step_b
+
+    residual, information = residuals()
+    gradient = np.bincount(player_slot, residual, n_players + 1) - prior_weight * theta
+    step_theta = np.clip(gradient / (np.bincount(player_slot, information, n_players + 1) + prior_weight), -1, 1)
+    theta += step_theta
+    theta[n_players] = 0.0
+
+    if max(np.abs(step_b).max(initial=0), np.abs(step_theta[:n_players]).max(initial=0)) < tolerance:
+      break
+  return b, theta[:n_players]
+
+'''
+calibrate_difficulty(min_attempts, prior_weight, dry_run)
+    fits every answered question and writes the level nearest its fitted b
+    to questions.difficulty for those with at least min_attempts answers
+    whose level changed. Returns (questions fitted, list of
+    (id, old difficulty, new difficulty)).
+'''
+def calibrate_difficulty(min_attempts=30, prior_weight=1.0, dry_run=False):
+  engine = db.engine
+  with engine.connect() as connection:
+    question_ids, player_codes, attempts, correct = load_outcomes(connection)
+    questions = np.array(connection.execute(
+      select([Question.id, func.coalesce(Question.difficulty, 0)]).order_by(Question.id)).fetchall(),
+      dtype=np.int64).reshape(-1, 2)
+  if len(question_ids) == 0 or len(questions) == 0:
+    return 0, []
+
+  ids, question_index = np.unique(question_ids, return_inverse=True)
+  # each answered question's row; outcomes of since-deleted questions are fitted but not written
+  row = np.minimum(np.searchsorted(questions[:, 0], ids), len(questions) - 1)
+  exists = questions[row, 0] == ids
+  current = np.where(exists, questions[row, 1], 0)
+
+  prior_b = level_logits(current)
+  b, _ = fit_rasch(question_index, player_codes, attempts, correct, prior_b, prior_weight=prior_weight)
+
+  levels = logits_to_levels(b)
+  totals = np.bincount(question_index, attempts, len(ids))
+  changed = np.flatnonzero(exists & (totals >= min_attempts) & (levels != current))
+  changes = [(int(ids[i]), int(current[i]), int(levels[i])) for i in changed]
+
+  if changes and not dry_run:
+    update = Question.__table__.update() \
+      .where(Question.id == bindparam('question_id')) \
+      .values(difficulty=bindparam('level'))
+    with engine.begin() as connection:
+      for start in range(0, len(changes), UPDATE_BATCH_SIZE):
+        connection.execute(update, [
+          {'question_id': question_id, 'level': level}
+          for question_id, _, level in changes[start:start + UPDATE_BATCH_SIZE]
+        ])
+    # core updates skip the ORM events; publishing tells the running servers too
+    publish_versions(engine, [Question])
+
+  return len(ids), changes
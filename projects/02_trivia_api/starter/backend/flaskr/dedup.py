@@ -0,0 +1,308 @@
+'''
+Duplicate question detection.
+
+Question text is normalized (case, accents, punctuation, spacing) before
+anything is compared. Exact duplicates are found through a 64-bit hash of
+the normalized text. Near-duplicates are found with MinHash signatures over
+character 4-grams. The signatures are banded into LSH buckets, so a lookup
+only compares the few questions that share a bucket. The index is kept in
+memory and saved to a file next to the database, so a restart only
+fingerprints questions added since the last save.
+
+The exact key is also stored in questions.text_key under a unique index, so
+the database refuses an exact duplicate even when it comes from a process
+whose index has not seen the original yet.
+'''
+import hashlib
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import unicodedata
+import zlib
+from array import array
+
+from sqlalchemy import event, func, select
+
+from models import Question
+
+SHINGLE_SIZE = 4
+NUM_PERM = 32
+BANDS = 8
+ROWS_PER_BAND = NUM_PERM // BANDS
+# largest prime below 2**32, so signature values fit in array('I')
+PRIME = 4294967291
+SEED = 1
+
+FILE_MAGIC = b'TRIVIA-DUPLICATES 1\n'
+
+NON_WORD = re.compile(r'[\W_]+')
+
+def normalize_text(text):
+  '''Lowercase, strip accents and punctuation, collapse whitespace.'''
+  text = unicodedata.normalize('NFKD', text)
+  text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+  return NON_WORD.sub(' ', text.lower()).strip()
+
+
+def exact_key(normalized):
+  return int.from_bytes(hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
+
+def question_key(text):
+  '''The exact key stored in questions.text_key.'''
+  return exact_key(normalize_text(text))
+
+
+def set_text_key(mapper, connection, target):
+  target.text_key = question_key(target.question) if target.question is not None else None
+
+# ORM writes keep text_key current; Core inserts set it themselves
+event.listen(Question, 'before_insert', set_text_key)
+event.listen(Question, 'before_update', set_text_key)
+
+
+def default_index_path(url, instance_path):
+  '''<db>.dedup next to a SQLite database, otherwise duplicate-index.bin in the instance folder.'''
+  if url.drivername.startswith('sqlite') and url.database:
+    return url.database + '.dedup'
+  return os.path.join(instance_path, 'duplicate-index.bin')
+
+
+def permutations(seed=SEED):
+  rng = random.Random(seed)
+  return [(rng.randrange(1, PRIME), rng.randrange(0, PRIME)) for _ in range(NUM_PERM)]
+
+PERMUTATIONS = permutations()
+
+'''
+fingerprint_text(text)
+    (exact key, MinHash signature) of a question's text; computed once and
+    passed to both find() and add().
+'''
+def fingerprint_text(text):
+  normalized = normalize_text(text)
+  if len(normalized) <= SHINGLE_SIZE:
+    shingles = {normalized}
+  else:
+    shingles = {normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+  hashes = [zlib.crc32(shingle.encode('utf-8')) for shingle in shingles]
+  signature = array('I', [min([(a * h + b) % PRIME for h in hashes]) for a, b in PERMUTATIONS])
+  return exact_key(normalized), signature
+
+
+def similarity(a, b):
+  '''MinHash estimate of the Jaccard similarity of two signatures.'''
+  return sum(1 for x, y in zip(a, b) if x == y) / NUM_PERM
+
+
+class DuplicateIndex(object):
+
+  def __init__(self, threshold=0.8):
+    self.threshold = threshold
+    self.lock = threading.Lock()
+    self.version = None
+    self.max_id = 0
+    self.dirty = False
+    # exact key -> first id with that text, and id -> its exact key
+    self.exact = {}
+    self.keys = {}
+    self.signatures = {}
+    # per band: band hash -> id, or a list of ids once several share it
+    self.buckets = [{} for _ in range(BANDS)]
+
+  def find(self, fingerprint):
+    '''
+    (id, similarity, exact) for the closest indexed question at or above
+    the threshold, or None. exact is True when the normalized texts match.
+    '''
+    key, signature = fingerprint
+    with self.lock:
+      question_id = self.exact.get(key)
+      if question_id is not None:
+        return question_id, 1.0, True
+      candidates = set()
+      for band in range(BANDS):
+        ids = self.buckets[band].get(self._band_key(signature, band))
+        if isinstance(ids, list):
+          candidates.update(ids)
+        elif ids is not None:
+          candidates.add(ids)
+      best = None
+      for candidate in candidates:
+        score = similarity(signature, self.signatures[candidate])
+        if score >= self.threshold and (best is None or score > best[1]):
+          best = (candidate, score, False)
+      return best
+
+  def add(self, question_id, fingerprint):
+    key, signature = fingerprint
+    with self.lock:
+      self._add(question_id, key, signature)
+
+  def remove(self, question_id):
+    with self.lock:
+      self._remove(question_id)
+
+  def _remove(self, question_id):
+    signature = self.signatures.pop(question_id, None)
+    if signature is None:
+      return
+    for band in range(BANDS):
+      buckets = self.buckets[band]
+      bucket_key = self._band_key(signature, band)
+      ids = buckets.get(bucket_key)
+      if isinstance(ids, list):
+        ids.remove(question_id)
+        if len(ids) == 1:
+          buckets[bucket_key] = ids[0]
+      elif ids == question_id:
+        del buckets[bucket_key]
+    key = self.keys.pop(question_id, None)
+    if key is not None and self.exact.get(key) == question_id:
+      del self.exact[key]
+    self.dirty = True
+
+  def advance(self, before, after):
+    '''Mark the index current at after if the only write since before was the one just applied.'''
+    with self.lock:
+      if self.version == before and after == before + 1:
+        self.version = after
+
+  def refresh(self, session, version, known=None):
+    '''
+    Catch up with the database: fingerprint rows added since max_id (using
+    `known`, exact key -> fingerprint, where the caller already has them).
+    If the row count or highest id still disagree with the index, rows were
+    deleted (or ids reused after a restore), and the ids are reconciled.
+    '''
+    known = known or {}
+
+    def add_rows(criterion):
+      rows = session.execute(select([Question.id, Question.question]).where(criterion).order_by(Question.id))
+      for question_id, text in rows:
+        fingerprint = known.get(exact_key(normalize_text(text or ''))) or fingerprint_text(text or '')
+        self.add(question_id, fingerprint)
+
+    add_rows(Question.id > self.max_id)
+    total, highest = session.execute(select([func.count(Question.id), func.max(Question.id)])).first()
+    if total != len(self.signatures) or (highest or 0) != self.max_id:
+      existing = {question_id for (question_id,) in session.execute(select([Question.id]))}
+      for question_id in [question_id for question_id in self.signatures if question_id not in existing]:
+        self.remove(question_id)
+      missing = existing.difference(self.signatures)
+      if missing:
+        add_rows(Question.id.in_(missing))
+      with self.lock:
+        self.max_id = highest or 0
+    self.version = version
+
+  def verify(self, session):
+    '''
+    Check a loaded index against every row's exact key, which is cheap to
+    compute, and fingerprint again only the rows whose text changed or that
+    are missing; drop ids that no longer exist. Used once after load(), as
+    the file may be older than the database.
+    '''
+    seen = set()
+    highest = 0
+    for question_id, text in session.execute(select([Question.id, Question.question])):
+      seen.add(question_id)
+      highest = max(highest, question_id)
+      normalized = normalize_text(text or '')
+      if self.keys.get(question_id) != exact_key(normalized):
+        self.remove(question_id)
+        self.add(question_id, fingerprint_text(text or ''))
+    for question_id in [question_id for question_id in self.signatures if question_id not in seen]:
+      self.remove(question_id)
+    with self.lock:
+      self.max_id = highest
+
+  def save(self, path):
+    '''Write the index atomically; the LSH buckets are rebuilt on load.'''
+    with self.lock:
+      ids = array('q', self.signatures)
+      signatures = array('I')
+      for question_id in ids:
+        signatures.extend(self.signatures[question_id])
+      exact = array('q')
+      for question_id, key in self.keys.items():
+        exact.extend((key, question_id))
+      header = {'max_id': self.max_id, 'count': len(ids), 'exact': len(exact) // 2,
+                'num_perm': NUM_PERM, 'seed': SEED, 'shingle_size': SHINGLE_SIZE}
+      self.dirty = False
+
+    directory = os.path.dirname(path)
+    if directory:
+      os.makedirs(directory, exist_ok=True)
+    # a temporary file of its own, so workers saving at once never share one
+    fd, temporary = tempfile.mkstemp(dir=directory or '.', prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        f.write(FILE_MAGIC)
+        f.write(json.dumps(header).encode('utf-8') + b'\n')
+        ids.tofile(f)
+        signatures.tofile(f)
+        exact.tofile(f)
+      os.replace(temporary, path)
+    except BaseException:
+      os.unlink(temporary)
+      raise
+
+  def load(self, path):
+    '''Load a saved index; False (index left empty) if it is missing or was built differently.'''
+    try:
+      with open(path, 'rb') as f:
+        if f.readline() != FILE_MAGIC:
+          return False
+        header = json.loads(f.readline())
+        if (header['num_perm'], header['seed'], header['shingle_size']) != (NUM_PERM, SEED, SHINGLE_SIZE):
+          return False
+        ids, signatures, exact = array('q'), array('I'), array('q')
+        ids.fromfile(f, header['count'])
+        signatures.fromfile(f, header['count'] * NUM_PERM)
+        exact.fromfile(f, header['exact'] * 2)
+    except (OSError, EOFError, ValueError, KeyError):
+      return False
+
+    with self.lock:
+      for i, question_id in enumerate(ids):
+        self._add(question_id, None, signatures[i * NUM_PERM:(i + 1) * NUM_PERM])
+      for i in range(0, len(exact), 2):
+        self.keys[exact[i + 1]] = exact[i]
+        self.exact.setdefault(exact[i], exact[i + 1])
+      self.max_id = max(self.max_id, header['max_id'])
+      self.dirty = False
+    return True
+
+  def __len__(self):
+    return len(self.signatures)
+
+  def _add(self, question_id, key, signature):
+    # re-adding an id (a refresh can pick up a row its creator is about to
+    # add) replaces the entry instead of listing the id twice in a bucket
+    self._remove(question_id)
+    if key is not None:
+      self.keys[question_id] = key
+      self.exact.setdefault(key, question_id)
+    self.signatures[question_id] = signature
+    for band in range(BANDS):
+      buckets = self.buckets[band]
+      bucket_key = self._band_key(signature, band)
+      ids = buckets.get(bucket_key)
+      if ids is None:
+        buckets[bucket_key] = question_id
+      elif isinstance(ids, list):
+        ids.append(question_id)
+      else:
+        buckets[bucket_key] = [ids, question_id]
+    if question_id > self.max_id:
+      self.max_id = question_id
+    self.dirty = True
+
+  @staticmethod
+  def _band_key(signature, band):
+    # int hashes of int tuples are not randomized, so keys are stable across runs
+    return hash(tuple(signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]))
@@ -0,0 +1,74 @@
+'''
+Pluggable JSON provider behind jsonify().
+
+The JSON_PROVIDER config key picks the encoder:
+- 'orjson' serializes with orjson, straight to bytes.
+- 'default' keeps Flask's stdlib provider.
+- 'auto' (the default) uses orjson when it is installed.
+
+Swapping providers needs app.json, which arrived in Flask 2.2. Older Flask
+always keeps its stdlib encoder.
+'''
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+try:
+  from flask.json.provider import DefaultJSONProvider
+except ImportError:
+  # Flask < 2.2
+  DefaultJSONProvider = None
+
+JSON_PROVIDERS = ('auto', 'orjson', 'default')
+
+
+if DefaultJSONProvider is not None:
+  class OrjsonProvider(DefaultJSONProvider):
+    '''
+    DefaultJSONProvider with orjson doing the encoding and decoding.
+
+    Category dicts are keyed by integer id, so non-string keys are allowed.
+    With sort_keys, orjson sorts keys by their string form.
+    '''
+
+    def options(self, indent=False):
+      option = orjson.OPT_NON_STR_KEYS
+      if self.sort_keys:
+        option |= orjson.OPT_SORT_KEYS
+      if indent:
+        option |= orjson.OPT_INDENT_2
+      return option
+
+    def dumps(self, obj, **kwargs):
+      return orjson.dumps(obj, default=self.default, option=self.options(bool(kwargs.get('indent')))).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+      return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+      obj = self._prepare_response_obj(args, kwargs)
+      indent = (self.compact is None and self._app.debug) or self.compact is False
+      # orjson already returns UTF-8 bytes; skip the str round trip
+      body = orjson.dumps(obj, default=self.default, option=self.options(indent)) + b'\n'
+      return self._app.response_class(body, mimetype=self.mimetype)
+
+
+'''
+init_json(app)
+    installs the provider selected by JSON_PROVIDER and returns its name
+    ('orjson' or 'default').
+'''
+def init_json(app):
+  choice = app.config['JSON_PROVIDER']
+  if choice not in JSON_PROVIDERS:
+    raise ValueError('JSON_PROVIDER must be one of {}, not {!r}'.format(', '.join(JSON_PROVIDERS), choice))
+
+  available = orjson is not None and DefaultJSONProvider is not None
+  if choice == 'orjson' and not available:
+    raise RuntimeError('JSON_PROVIDER=orjson needs the orjson package and Flask 2.2 or later')
+
+  if choice != 'default' and available:
+    app.json = OrjsonProvider(app)
+    return 'orjson'
+  return 'default'
@@ -0,0 +1,299 @@
+import random
+import secrets
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+# random draws tried before falling back to scanning for the unseen ids
+MAX_DRAWS = 8
+
+# adaptive mode: difficulty range, starting level, and the run of correct
+# answers that moves a player up a level (any miss moves them down one)
+MIN_DIFFICULTY = 1
+MAX_DIFFICULTY = 5
+START_DIFFICULTY = 1
+LEVEL_UP_STREAK = 2
+
+# session columns added to the spill table after its first version
+SPILL_COLUMNS = (('player', 'TEXT'), ('last_question', 'INTEGER'), ('answered', 'INTEGER'), ('score', 'INTEGER'))
+# seconds between purges of expired sessions from the spill file
+PURGE_INTERVAL = 60
+
+'''
+QuizPool
+    per-category arrays of question ids (category 0 holds every question),
+    also bucketed by difficulty, loaded once per question version. Picking
+    the next unseen question is a few random draws from one array instead
+    of loading and filtering the category.
+'''
+class QuizPool(object):
+
+  def __init__(self):
+    self.version = None
+    self.ids = {0: array('l')}
+    self.by_difficulty = {0: {}}
+
+  def load(self, version, rows):
+    # rows: (id, category, difficulty)
+    ids = {0: array('l')}
+    by_difficulty = {0: {}}
+    for question_id, category, difficulty in rows:
+      keys = (0,) if category is None else (0, int(category))
+      for key in keys:
+        ids.setdefault(key, array('l')).append(question_id)
+        if difficulty is not None:
+          by_difficulty.setdefault(key, {}).setdefault(int(difficulty), array('l')).append(question_id)
+    self.ids = ids
+    self.by_difficulty = by_difficulty
+    self.version = version
+
+  def pick(self, category_id, seen, difficulty=None):
+    '''
+    Random question id from category_id not in seen, or None when exhausted.
+    With a difficulty, the nearest level that still has unseen questions wins.
+    '''
+    if difficulty is None:
+      return self._pick(self.ids.get(category_id), seen)
+
+    buckets = self.by_difficulty.get(category_id, {})
+    for level in sorted(buckets, key=lambda level: (abs(level - difficulty), level)):
+      question_id = self._pick(buckets[level], seen)
+      if question_id is not None:
+        return question_id
+    return None
+
+  def _pick(self, ids, seen):
+    if not ids:
+      return None
+
+    # rejection sampling is O(1) expected while most of the array is unseen
+    for _ in range(MAX_DRAWS):
+      question_id = ids[random.randrange(len(ids))]
+      if question_id not in seen:
+        return question_id
+
+    remaining = [question_id for question_id in ids if question_id not in seen]
+    if not remaining:
+      return None
+    return random.choice(remaining)
+
+'''
+SeenSet
+    sorted array('l') of question ids, used as a compact set. A quiz only
+    sees a few dozen questions, so bisect lookups beat a hash set on memory.
+'''
+class SeenSet(object):
+  __slots__ = ('ids',)
+
+  def __init__(self, ids=()):
+    self.ids = array('l', sorted(set(ids)))
+
+  def __contains__(self, question_id):
+    i = bisect_left(self.ids, question_id)
+    return i < len(self.ids) and self.ids[i] == question_id
+
+  def __len__(self):
+    return len(self.ids)
+
+  def add(self, question_id):
+    i = bisect_left(self.ids, question_id)
+    if i == len(self.ids) or self.ids[i] != question_id:
+      self.ids.insert(i, question_id)
+
+  def tobytes(self):
+    return self.ids.tobytes()
+
+  @classmethod
+  def frombytes(cls, data):
+    seen = cls()
+    seen.ids.frombytes(data)
+    return seen
+
+
+'''
+valid_question_ids
+    the previous_questions a stateless client sent, as a set of ids; None
+    unless it is a list of integers.
+'''
+def valid_question_ids(value):
+  if not isinstance(value, list):
+    return None
+  if not all(isinstance(question_id, int) and not isinstance(question_id, bool) for question_id in value):
+    return None
+  return set(value)
+
+
+class QuizSession(object):
+  __slots__ = ('category_id', 'seen', 'expires', 'difficulty', 'streak',
+               'player', 'last_question', 'answered', 'score')
+
+  def __init__(self, category_id, seen, expires, difficulty=None, streak=0,
+               player=None, last_question=None, answered=0, score=0):
+    self.category_id = category_id
+    self.seen = seen
+    self.expires = expires
+    # None unless the session is adaptive
+    self.difficulty = difficulty
+    self.streak = streak
+    self.player = player
+    # the question the player is currently answering
+    self.last_question = last_question
+    self.answered = answered
+    self.score = score
+
+  def record(self, correct):
+    '''Tally an answer and move an adaptive session's difficulty with the player's streak.'''
+    self.answered += 1
+    if correct:
+      self.score += 1
+    if self.difficulty is None:
+      return
+    if correct:
+      self.streak += 1
+      if self.streak >= LEVEL_UP_STREAK:
+        self.difficulty = min(self.difficulty + 1, MAX_DIFFICULTY)
+        self.streak = 0
+    else:
+      self.difficulty = max(self.difficulty - 1, MIN_DIFFICULTY)
+      self.streak = 0
+
+
+'''
+QuizSessionStore
+    bounded in-memory store of quiz sessions with a TTL and LRU eviction.
+    With a spill_path, sessions evicted for space are written to SQLite and
+    loaded back on their next request instead of being lost. Evicted
+    sessions are written after the store lock is released, under a separate
+    spill lock, and each write also purges rows that expired on disk (at
+    most once every PURGE_INTERVAL seconds).
+'''
+class QuizSessionStore(object):
+
+  def __init__(self, max_sessions=10000, ttl=1800, spill_path=None):
+    self.max_sessions = max_sessions
+    self.ttl = ttl
+    self.sessions = OrderedDict()
+    self.lock = threading.Lock()
+    self.spill = None
+    if spill_path:
+      # only spilling stores need sqlite3; keep it out of the default import path
+      import sqlite3
+      self.spill = sqlite3.connect(spill_path, check_same_thread=False)
+      self.spill.execute('CREATE TABLE IF NOT EXISTS quiz_sessions '
+                         '(id TEXT PRIMARY KEY, category_id INTEGER, seen BLOB, expires REAL, '
+                         'difficulty INTEGER, streak INTEGER)')
+      # spill files written before sessions tracked players and scores
+      columns = {row[1] for row in self.spill.execute('PRAGMA table_info(quiz_sessions)')}
+      for column, column_type in SPILL_COLUMNS:
+        if column not in columns:
+          self.spill.execute('ALTER TABLE quiz_sessions ADD COLUMN {} {}'.format(column, column_type))
+      self.spill.execute('CREATE INDEX IF NOT EXISTS quiz_sessions_expires ON quiz_sessions (expires)')
+      self.spill.commit()
+    # taken before self.lock; serializes the spill connection
+    self.spill_lock = threading.Lock()
+    # evicted sessions not yet written to the spill file
+    self.pending = {}
+    self.next_purge = 0
+
+  def create(self, category_id, seen=(), difficulty=None, player=None):
+    session_id = secrets.token_urlsafe(16)
+    with self.lock:
+      self.sessions[session_id] = QuizSession(category_id, SeenSet(seen), time.time() + self.ttl, difficulty,
+                                              player=player)
+      evicted = self._evict()
+    self._write_spill(evicted)
+    return session_id
+
+  def get(self, session_id):
+    '''The live session for session_id, or None when unknown or expired.'''
+    with self.lock:
+      found, session, evicted = self._touch(session_id)
+    if not found and self.spill is not None:
+      with self.spill_lock:
+        # no spill write runs now, so a pending session is not on disk yet
+        loaded = self._unspill(session_id)
+        with self.lock:
+          if session_id not in self.sessions:
+            loaded = self.pending.pop(session_id, loaded)
+            if loaded is not None:
+              self.sessions[session_id] = loaded
+          found, session, evicted = self._touch(session_id)
+    self._write_spill(evicted)
+    return session
+
+  def discard(self, session_id):
+    if self.spill is None:
+      with self.lock:
+        self.sessions.pop(session_id, None)
+      return
+    with self.spill_lock:
+      with self.lock:
+        self.sessions.pop(session_id, None)
+        self.pending.pop(session_id, None)
+      self.spill.execute('DELETE FROM quiz_sessions WHERE id = ?', (session_id,))
+      self.spill.commit()
+
+  def __len__(self):
+    return len(self.sessions)
+
+  def _touch(self, session_id):
+    '''
+    (found, live session or None, evicted sessions) for a session in
+    memory; call with the lock held.
+    '''
+    session = self.sessions.get(session_id)
+    if session is None:
+      return False, None, []
+    now = time.time()
+    if session.expires < now:
+      del self.sessions[session_id]
+      return True, None, []
+    session.expires = now + self.ttl
+    self.sessions.move_to_end(session_id)
+    return True, session, self._evict()
+
+  def _evict(self):
+    '''Drop the least recently used sessions over max_sessions; returns the ones to spill.'''
+    now = time.time()
+    evicted = []
+    while len(self.sessions) > self.max_sessions:
+      session_id, session = self.sessions.popitem(last=False)
+      if self.spill is not None and session.expires >= now:
+        self.pending[session_id] = session
+        evicted.append((session_id, session))
+    return evicted
+
+  def _write_spill(self, evicted):
+    '''Write evicted sessions to the spill file; call without the lock held.'''
+    if not evicted:
+      return
+    with self.spill_lock:
+      with self.lock:
+        # skip sessions a request took back before this write
+        rows = [(session_id, session.category_id, session.seen.tobytes(), session.expires,
+                 session.difficulty, session.streak, session.player, session.last_question,
+                 session.answered, session.score)
+                for session_id, session in evicted if self.pending.get(session_id) is session]
+        for row in rows:
+          del self.pending[row[0]]
+      self.spill.executemany('INSERT OR REPLACE INTO quiz_sessions (id, category_id, seen, expires, difficulty, '
+                             'streak, player, last_question, answered, score) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                             rows)
+      now = time.time()
+      if now >= self.next_purge:
+        self.spill.execute('DELETE FROM quiz_sessions WHERE expires < ?', (now,))
+        self.next_purge = now + PURGE_INTERVAL
+      self.spill.commit()
+
+  def _unspill(self, session_id):
+    '''Load and remove a spilled session; call with the spill lock held.'''
+    row = self.spill.execute('SELECT category_id, seen, expires, difficulty, streak, player, last_question, '
+                             'coalesce(answered, 0), coalesce(score, 0) FROM quiz_sessions WHERE id = ?',
+                             (session_id,)).fetchone()
+    if row is None:
+      return None
+    self.spill.execute('DELETE FROM quiz_sessions WHERE id = ?', (session_id,))
+    self.spill.commit()
+    return QuizSession(row[0], SeenSet.frombytes(row[1]), row[2], *row[3:])
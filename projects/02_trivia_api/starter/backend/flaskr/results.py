@@ -0,0 +1,188 @@
+'''
+Quiz results and answer outcomes: buffered writes and an in-memory leaderboard.
+'''
+import atexit
+import threading
+from bisect import insort
+from datetime import datetime
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Question, QuizResult, AnswerOutcome
+
+MAX_PLAYER_NAME = 50
+
+'''
+ResultRecorder
+    collects quiz results and answer outcomes in memory. A background
+    thread writes them as batched inserts every flush_interval seconds, or
+    sooner once batch_size rows are waiting, so /quizzes never waits on a
+    commit. If a flush fails, its rows go back into the buffer up to
+    max_buffer rows. Anything beyond that is dropped and counted.
+'''
+class ResultRecorder(object):
+
+  def __init__(self, app, flush_interval=1.0, batch_size=500, max_buffer=100000):
+    self.app = app
+    self.flush_interval = flush_interval
+    self.batch_size = batch_size
+    self.max_buffer = max_buffer
+    self.lock = threading.Lock()
+    self.results = []
+    self.outcomes = []
+    self.dropped = 0
+    self.wake = threading.Event()
+    self.stopped = False
+    self.thread = None
+
+  def record_result(self, player, category, score, total):
+    self._append(self.results, {
+      'player': player,
+      'category': category,
+      'score': score,
+      'total': total,
+      'played_at': datetime.utcnow()
+    })
+
+  def record_outcome(self, question_id, correct, player=None):
+    self._append(self.outcomes, {
+      'question_id': question_id,
+      'player': player,
+      'correct': correct,
+      'answered_at': datetime.utcnow()
+    })
+
+  def pending(self):
+    return len(self.results) + len(self.outcomes)
+
+  def flush(self):
+    '''Write everything buffered so far; safe to call from any thread.'''
+    with self.lock:
+      results, self.results = self.results, []
+      outcomes, self.outcomes = self.outcomes, []
+    if not results and not outcomes:
+      return
+
+    engine = db.get_engine(self.app)
+    for table, rows, insert in ((self.results, results, self._insert_results),
+                                (self.outcomes, outcomes, self._insert_outcomes)):
+      if not rows:
+        continue
+      try:
+        insert(engine, rows)
+      except Exception:
+        self.app.logger.exception('flushing %d quiz records failed', len(rows))
+        self._requeue(table, rows)
+
+  def close(self):
+    '''Stop the flush thread and write what is left.'''
+    self.stopped = True
+    self.wake.set()
+    if self.thread is not None:
+      self.thread.join()
+      self.thread = None
+    self.flush()
+
+  def _append(self, table, row):
+    with self.lock:
+      if self.thread is None and not self.stopped:
+        self.thread = threading.Thread(target=self._run, name='result-recorder', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+      if len(self.results) + len(self.outcomes) >= self.max_buffer:
+        self.dropped += 1
+        return
+      table.append(row)
+      if len(table) >= self.batch_size:
+        self.wake.set()
+
+  def _requeue(self, table, rows):
+    with self.lock:
+      room = max(0, self.max_buffer - len(self.results) - len(self.outcomes))
+      table[:0] = rows[:room]
+      self.dropped += len(rows) - min(room, len(rows))
+
+  def _run(self):
+    while not self.stopped:
+      self.wake.wait(self.flush_interval)
+      self.wake.clear()
+      self.flush()
+
+  def _insert_results(self, engine, rows):
+    with engine.begin() as connection:
+      connection.execute(QuizResult.__table__.insert(), rows)
+
+  def _insert_outcomes(self, engine, rows):
+    try:
+      with engine.begin() as connection:
+        connection.execute(AnswerOutcome.__table__.insert(), rows)
+    except IntegrityError:
+      # a question was deleted while its outcomes sat in the buffer
+      with engine.begin() as connection:
+        ids = {row['question_id'] for row in rows}
+        existing = {question_id for (question_id,) in connection.execute(
+          select([Question.id]).where(Question.id.in_(ids)))}
+        rows = [row for row in rows if row['question_id'] in existing]
+        if rows:
+          connection.execute(AnswerOutcome.__table__.insert(), rows)
+
+'''
+Leaderboard
+    each quiz category's top `size` players by best score (0 is the "All"
+    category). Ties go to the player whose name sorts first. Boards are
+    sorted lists of (-score, player) capped at size. A new result
+    costs one scan of its board, and reading a board costs nothing. Offering
+    the same result twice changes nothing, so loading from the database can
+    overlap with live recording.
+'''
+class Leaderboard(object):
+
+  def __init__(self, size=10):
+    self.size = size
+    self.lock = threading.Lock()
+    self.loaded = False
+    self.boards = {}
+
+  def load(self, session):
+    rows = session.execute(
+      select([QuizResult.category, QuizResult.player, func.max(QuizResult.score).label('score')])
+      .group_by(QuizResult.category, QuizResult.player))
+    for row in rows:
+      self.offer(row['category'], row['player'], row['score'])
+    self.loaded = True
+
+  def offer(self, category, player, score):
+    '''Add a result; return the player's 1-based rank if it is on the board.'''
+    entry = (-score, player)
+    with self.lock:
+      board = self.boards.setdefault(category, [])
+      current = next((i for i, existing in enumerate(board) if existing[1] == player), None)
+      if current is not None:
+        if board[current] <= entry:
+          return current + 1
+        del board[current]
+      elif len(board) >= self.size and entry >= board[-1]:
+        return None
+      insort(board, entry)
+      del board[self.size:]
+      return board.index(entry) + 1
+
+  def top(self, category, limit=None):
+    with self.lock:
+      board = list(self.boards.get(category, ()))
+    return [{
+      'rank': rank,
+      'player': player,
+      'score': -negative_score
+    } for rank, (negative_score, player) in enumerate(board[:limit], 1)]
+
+
+def valid_player(player):
+  '''The trimmed player name, or None if it is missing or too long.'''
+  if not isinstance(player, str):
+    return None
+  player = player.strip()
+  if not player or len(player) > MAX_PLAYER_NAME:
+    return None
+  return player
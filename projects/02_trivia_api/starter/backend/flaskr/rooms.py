@@ -0,0 +1,204 @@
+'''
+Multiplayer quiz rooms pushed to clients as Server-Sent Events.
+'''
+import json
+import secrets
+import threading
+import time
+from collections import deque
+
+from .quiz import SeenSet
+
+# room codes avoid characters that are easy to misread (0/O, 1/I/L)
+CODE_ALPHABET = 'ABCDEFGHJKMNPQRSTUVWXYZ23456789'
+CODE_LENGTH = 6
+
+def sse(event_id, event_type, data):
+  return 'id: {}\nevent: {}\ndata: {}\n\n'.format(event_id, event_type, json.dumps(data))
+
+'''
+Room
+    one room's state plus a short log of its serialized events. Publishing
+    serializes the event once, appends it to the log and wakes the waiting
+    streams through one Condition. The cost does not depend on how many
+    players are listening; each stream copies the events past its own
+    cursor.
+'''
+class Room(object):
+
+  def __init__(self, code, category_id, host, backlog=64):
+    self.code = code
+    self.category_id = category_id
+    self.host = host
+    self.lock = threading.Lock()
+    self.players = {host: 0}
+    self.seen = SeenSet()
+    self.question = None
+    self.answered = set()
+    self.round = 0
+    self.finished = False
+    self.closed = False
+    self.event_id = 0
+    self.log = deque(maxlen=backlog)
+    self.changed = threading.Condition(self.lock)
+    self.last_active = time.monotonic()
+
+  def snapshot(self):
+    return {
+      'code': self.code,
+      'category': self.category_id,
+      'host': self.host,
+      'players': dict(self.players),
+      'round': self.round,
+      'question': self.question,
+      'answered': sorted(self.answered),
+      'finished': self.finished
+    }
+
+  def publish(self, event_type='state', data=None):
+    '''Log the event and wake every stream; call with the room lock held.'''
+    self.event_id += 1
+    self.last_active = time.monotonic()
+    self.log.append(sse(self.event_id, event_type, self.snapshot() if data is None else data))
+    self.changed.notify_all()
+
+
+'''
+RoomRegistry
+    the live rooms by code. Every change to a room publishes its new state
+    to the room's event streams. A sweeper thread, started with the first
+    room, wakes every sweep_interval seconds. It closes rooms that have been
+    idle for ttl seconds and rooms that have no players left.
+'''
+class RoomRegistry(object):
+
+  def __init__(self, max_rooms=1000, max_players=50, ttl=600, sweep_interval=30, backlog=64):
+    self.max_rooms = max_rooms
+    self.max_players = max_players
+    self.ttl = ttl
+    self.sweep_interval = sweep_interval
+    self.backlog = backlog
+    self.lock = threading.Lock()
+    self.rooms = {}
+    self.sweeper = None
+
+  def create(self, category_id, host):
+    '''A new room with host as its first player, or None when the registry is full.'''
+    with self.lock:
+      if len(self.rooms) >= self.max_rooms:
+        return None
+      code = self._new_code()
+      room = Room(code, category_id, host, self.backlog)
+      self.rooms[code] = room
+      if self.sweeper is None:
+        self.sweeper = threading.Thread(target=self._sweep_forever, name='room-sweeper', daemon=True)
+        self.sweeper.start()
+    return room
+
+  def get(self, code):
+    room = self.rooms.get(code.upper())
+    if room is None or room.closed:
+      return None
+    return room
+
+  def join(self, room, player):
+    '''Add player to the room; False if the room is full or the name is taken.'''
+    with room.lock:
+      if player in room.players or len(room.players) >= self.max_players:
+        return False
+      room.players[player] = 0
+      room.publish()
+    return True
+
+  def leave(self, room, player):
+    with room.lock:
+      if room.players.pop(player, None) is not None:
+        if room.host == player and room.players:
+          room.host = next(iter(room.players))
+        room.publish()
+
+  def next_question(self, room, pick):
+    '''
+    Move the room to the question pick(category_id, seen) returns (a dict or
+    None); None finishes the game.
+    '''
+    with room.lock:
+      question = pick(room.category_id, room.seen)
+      room.answered = set()
+      if question is None:
+        room.question = None
+        room.finished = True
+      else:
+        room.seen.add(question['id'])
+        room.question = question
+        room.round += 1
+      room.publish()
+      return question
+
+  def answer(self, room, player, question_id, correct):
+    '''
+    Score a player's first answer to question_id. Returns the question
+    answered, or None if the player may not answer it or the room has moved
+    on to another question.
+    '''
+    with room.lock:
+      if player not in room.players or room.question is None or player in room.answered:
+        return None
+      if room.question['id'] != question_id:
+        return None
+      room.answered.add(player)
+      if correct:
+        room.players[player] += 1
+      room.publish()
+      return room.question
+
+  def events(self, room, cursor, timeout):
+    '''
+    (events after cursor, new cursor), waiting up to timeout seconds for
+    one. cursor None, or a cursor that has fallen out of the log, gets a
+    snapshot of the current state instead. Returns None once the room is
+    closed and the stream has seen its last event.
+    '''
+    with room.changed:
+      if cursor == room.event_id:
+        if room.closed:
+          return None
+        room.changed.wait(timeout)
+      missed = room.event_id - (cursor or 0)
+      if cursor is None or missed > len(room.log):
+        if room.closed:
+          return None
+        return [sse(room.event_id, 'state', room.snapshot())], room.event_id
+      return list(room.log)[len(room.log) - missed:], room.event_id
+
+  def close(self, room):
+    with room.lock:
+      if room.closed:
+        return
+      room.closed = True
+      room.publish('closed', {'code': room.code})
+    with self.lock:
+      self.rooms.pop(room.code, None)
+
+  def sweep(self):
+    '''Close idle and empty rooms; returns how many were closed.'''
+    cutoff = time.monotonic() - self.ttl
+    with self.lock:
+      stale = [room for room in self.rooms.values() if room.last_active < cutoff or not room.players]
+    for room in stale:
+      self.close(room)
+    return len(stale)
+
+  def __len__(self):
+    return len(self.rooms)
+
+  def _new_code(self):
+    while True:
+      code = ''.join(secrets.choice(CODE_ALPHABET) for _ in range(CODE_LENGTH))
+      if code not in self.rooms:
+        return code
+
+  def _sweep_forever(self):
+    while True:
+      time.sleep(self.sweep_interval)
+      self.sweep()
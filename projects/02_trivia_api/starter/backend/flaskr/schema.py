@@ -0,0 +1,150 @@
+'''
+Schema setup and changes for databases created before the current models.
+
+ensure_schema(app)
+    brings the app's database up to SCHEMA_VERSION (tables, search index,
+    questions.text_key and the data_versions rows) only when the version stored in the database
+    differs, and only once per database per process. Booting against an
+    up-to-date database costs one small SELECT instead of a create_all()
+    round of catalog queries.
+
+migrate_question_category(engine, batch_size)
+    converts questions.category from a string column to an indexed integer
+    foreign key to categories.id. The new values are backfilled in id-range
+    batches, each in its own transaction, so large tables are never locked
+    for the whole copy. Every step checks the catalog first, so the
+    migration can be re-run after an interruption.
+'''
+from sqlalchemy import MetaData, Table, Column, Integer, bindparam, inspect, select, text
+
+from models import db, DataVersion, Category, Question
+from .dedup import question_key
+from .search import setup_search
+
+# bump whenever models.py or the search index setup changes
+SCHEMA_VERSION = 4
+# rows given a text_key per transaction
+TEXT_KEY_BATCH_SIZE = 1000
+
+schema_version = Table('schema_version', MetaData(), Column('version', Integer, nullable=False))
+
+# database URIs already checked by this process
+_checked = set()
+
+def ensure_schema(app):
+  uri = app.config['SQLALCHEMY_DATABASE_URI']
+  if uri in _checked:
+    return
+
+  engine = db.get_engine(app)
+  with engine.begin() as connection:
+    schema_version.create(connection, checkfirst=True)
+    current = connection.execute(schema_version.select()).scalar()
+
+  if current != SCHEMA_VERSION:
+    db.create_all(app=app)
+    setup_search(engine)
+    backfill_text_keys(engine)
+    with engine.begin() as connection:
+      seed_data_versions(connection)
+      connection.execute(schema_version.delete())
+      connection.execute(schema_version.insert(), {'version': SCHEMA_VERSION})
+
+  _checked.add(uri)
+
+
+def backfill_text_keys(engine):
+  '''
+  Add questions.text_key if it is missing and fill it in for rows without
+  one, then add its unique index. Only the first of several rows with the
+  same text gets the key; the others (duplicates stored before the column
+  existed) keep NULL.
+  '''
+  table = Question.__table__
+  columns = {column['name'] for column in inspect(engine).get_columns('questions')}
+  with engine.begin() as connection:
+    if 'text_key' not in columns:
+      connection.execute(text('ALTER TABLE questions ADD COLUMN text_key BIGINT'))
+    taken = {row[0] for row in connection.execute(select([table.c.text_key]).where(table.c.text_key.isnot(None)))}
+    rows = connection.execute(select([table.c.id, table.c.question])
+                              .where(table.c.text_key.is_(None)).order_by(table.c.id)).fetchall()
+
+  updates = []
+  for question_id, question in rows:
+    key = question_key(question) if question is not None else None
+    if key is not None and key not in taken:
+      taken.add(key)
+      updates.append({'question_id': question_id, 'key': key})
+  update = table.update().where(table.c.id == bindparam('question_id')).values(text_key=bindparam('key'))
+  for start in range(0, len(updates), TEXT_KEY_BATCH_SIZE):
+    with engine.begin() as connection:
+      connection.execute(update, updates[start:start + TEXT_KEY_BATCH_SIZE])
+
+  with engine.begin() as connection:
+    connection.execute(text('CREATE UNIQUE INDEX IF NOT EXISTS ix_questions_text_key ON questions (text_key)'))
+
+
+def seed_data_versions(connection):
+  '''One data_versions row per cached table; existing rows keep their version.'''
+  table = DataVersion.__table__
+  present = {row[0] for row in connection.execute(table.select())}
+  for model in (Category, Question):
+    if model.__tablename__ not in present:
+      connection.execute(table.insert(), {'name': model.__tablename__, 'version': 0})
+
+
+def migrate_question_category(engine, batch_size=10000, log=print):
+  if engine.dialect.name != 'postgresql':
+    # other databases are only ever created from the current models
+    log('questions.category: nothing to migrate on {}'.format(engine.dialect.name))
+    return
+
+  with engine.connect() as connection:
+    data_type = connection.execute(text(
+      "SELECT data_type FROM information_schema.columns "
+      "WHERE table_name = 'questions' AND column_name = 'category'"
+    )).scalar()
+
+    if data_type != 'integer':
+      connection.execute(text('ALTER TABLE questions ADD COLUMN IF NOT EXISTS category_int integer'))
+
+      low, high = connection.execute(text('SELECT min(id), max(id) FROM questions')).first()
+      if low is not None:
+        for start in range(low - 1, high, batch_size):
+          with connection.begin():
+            connection.execute(text(
+              "UPDATE questions SET category_int = CASE WHEN category ~ '^[0-9]+$' THEN category::integer END "
+              "WHERE id > :start AND id <= :stop"
+            ), {'start': start, 'stop': start + batch_size})
+          log('questions.category: backfilled ids up to {}'.format(min(start + batch_size, high)))
+
+      # rows written while the batches ran: block writes (reads go on) and
+      # convert whatever is still out of step, in the same transaction as the swap
+      with connection.begin():
+        connection.execute(text('LOCK TABLE questions IN SHARE ROW EXCLUSIVE MODE'))
+        caught_up = connection.execute(text(
+          "UPDATE questions SET category_int = CASE WHEN category ~ '^[0-9]+$' THEN category::integer END "
+          "WHERE category_int IS DISTINCT FROM CASE WHEN category ~ '^[0-9]+$' THEN category::integer END"
+        )).rowcount
+        log('questions.category: caught up {} rows written during the backfill'.format(caught_up))
+        connection.execute(text('ALTER TABLE questions DROP COLUMN category'))
+        connection.execute(text('ALTER TABLE questions RENAME COLUMN category_int TO category'))
+
+    has_foreign_key = connection.execute(text(
+      "SELECT 1 FROM pg_constraint WHERE conrelid = 'questions'::regclass AND contype = 'f'"
+    )).first()
+    if not has_foreign_key:
+      # NOT VALID takes only a brief lock; VALIDATE then scans without blocking writes
+      with connection.begin():
+        connection.execute(text(
+          'ALTER TABLE questions ADD CONSTRAINT questions_category_fkey FOREIGN KEY (category) '
+          'REFERENCES categories (id) ON UPDATE CASCADE ON DELETE SET NULL NOT VALID'
+        ))
+      with connection.begin():
+        connection.execute(text('ALTER TABLE questions VALIDATE CONSTRAINT questions_category_fkey'))
+
+  # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+  with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+    connection.execute(text('CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_questions_category ON questions (category)'))
+
+  log('questions.category: integer foreign key with index ix_questions_category')
@@ -0,0 +1,138 @@
+'''
+Ranked full-text search over question and answer text.
+
+Postgres uses an expression GIN index on a tsvector of both columns and
+ranks with ts_rank_cd. SQLite (used for tests) uses an external-content
+FTS5 table kept in sync by triggers and ranks with bm25.
+'''
+import html
+
+from sqlalchemy import text
+
+# the database marks matches with these control characters; the snippet is
+# HTML-escaped first and only then are they turned into <mark> tags
+MARK_START = '\x02'
+MARK_STOP = '\x03'
+
+PG_DOCUMENT = "to_tsvector('english', coalesce(question, '') || ' ' || coalesce(answer, ''))"
+
+PG_SETUP = [
+  'CREATE INDEX IF NOT EXISTS ix_questions_search ON questions USING gin ({})'.format(PG_DOCUMENT)
+]
+
+SQLITE_SETUP = [
+  "CREATE VIRTUAL TABLE questions_fts USING fts5(question, answer, content='questions', content_rowid='id')",
+  '''CREATE TRIGGER questions_fts_ai AFTER INSERT ON questions BEGIN
+       INSERT INTO questions_fts(rowid, question, answer) VALUES (new.id, new.question, new.answer);
+     END''',
+  '''CREATE TRIGGER questions_fts_ad AFTER DELETE ON questions BEGIN
+       INSERT INTO questions_fts(questions_fts, rowid, question, answer) VALUES ('delete', old.id, old.question, old.answer);
+     END''',
+  '''CREATE TRIGGER questions_fts_au AFTER UPDATE ON questions BEGIN
+       INSERT INTO questions_fts(questions_fts, rowid, question, answer) VALUES ('delete', old.id, old.question, old.answer);
+       INSERT INTO questions_fts(rowid, question, answer) VALUES (new.id, new.question, new.answer);
+     END''',
+  "INSERT INTO questions_fts(questions_fts) VALUES ('rebuild')"
+]
+
+'''
+setup_search(engine)
+    creates the search index for the engine's dialect if it is missing.
+'''
+def setup_search(engine):
+  with engine.begin() as connection:
+    if engine.dialect.name == 'postgresql':
+      for statement in PG_SETUP:
+        connection.execute(text(statement))
+    elif engine.dialect.name == 'sqlite':
+      exists = connection.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'questions_fts'"
+      )).first()
+      if not exists:
+        for statement in SQLITE_SETUP:
+          connection.execute(text(statement))
+
+
+def fts5_query(term):
+  # quote every word so user input can't break the FTS5 query syntax
+  return ' '.join('"{}"'.format(word.replace('"', '""')) for word in term.split())
+
+'''
+ranked_search_sql(dialect, term, page, per_page, highlight=False)
+    (rows sql, count sql, params) for one page of ranked matches on the given
+    dialect name, or None when the term has no searchable words. Shared by
+    the WSGI app and the async app, which run it on different drivers.
+'''
+def ranked_search_sql(dialect, term, page, per_page, highlight=False):
+  params = {'limit': per_page, 'offset': (page-1) * per_page}
+
+  if dialect == 'sqlite':
+    params['term'] = fts5_query(term)
+    if not params['term']:
+      return None
+    snippet = ''
+    if highlight:
+      snippet = ', highlight(questions_fts, 0, :mark_start, :mark_stop) AS snippet'
+      params.update(mark_start=MARK_START, mark_stop=MARK_STOP)
+    rows_sql = (
+      'SELECT q.id, q.question, q.answer, q.category, q.difficulty, -bm25(questions_fts) AS rank' + snippet +
+      ' FROM questions_fts JOIN questions q ON q.id = questions_fts.rowid'
+      ' WHERE questions_fts MATCH :term'
+      ' ORDER BY rank DESC, q.id LIMIT :limit OFFSET :offset'
+    )
+    count_sql = 'SELECT count(*) FROM questions_fts WHERE questions_fts MATCH :term'
+  else:
+    params['term'] = term
+    snippet = ''
+    if highlight:
+      snippet = ", ts_headline('english', question, query, :headline_options) AS snippet"
+      params['headline_options'] = 'StartSel={}, StopSel={}'.format(MARK_START, MARK_STOP)
+    rows_sql = (
+      'SELECT id, question, answer, category, difficulty, ts_rank_cd(' + PG_DOCUMENT + ', query) AS rank' + snippet +
+      " FROM questions, plainto_tsquery('english', :term) query"
+      ' WHERE ' + PG_DOCUMENT + ' @@ query'
+      ' ORDER BY rank DESC, id LIMIT :limit OFFSET :offset'
+    )
+    count_sql = (
+      'SELECT count(*) FROM questions'
+      " WHERE " + PG_DOCUMENT + " @@ plainto_tsquery('english', :term)"
+    )
+  return rows_sql, count_sql, params
+
+
+def highlight_snippet(snippet):
+  # question text is user input: escape it before adding markup of our own
+  return html.escape(snippet).replace(MARK_START, '<mark>').replace(MARK_STOP, '</mark>')
+
+
+def format_ranked_rows(rows, highlight=False):
+  questions = []
+  for row in rows:
+    question = {
+      'id': row['id'],
+      'question': row['question'],
+      'answer': row['answer'],
+      'category': row['category'],
+      'difficulty': row['difficulty'],
+      'rank': round(row['rank'], 4)
+    }
+    if highlight:
+      question['snippet'] = highlight_snippet(row['snippet'])
+    questions.append(question)
+  return questions
+
+'''
+ranked_search(session, term, page, per_page, highlight=False)
+    one page of questions matching term, best match first, and the total
+    number of matches. With highlight, each result gets a 'snippet': the
+    HTML-escaped question with the matched words wrapped in <mark>.
+'''
+def ranked_search(session, term, page, per_page, highlight=False):
+  statements = ranked_search_sql(session.get_bind().dialect.name, term, page, per_page, highlight)
+  if statements is None:
+    return [], 0
+  rows_sql, count_sql, params = statements
+
+  rows = session.execute(text(rows_sql), params)
+  total = session.execute(text(count_sql), params).scalar()
+  return format_ranked_rows(rows, highlight), total
@@ -0,0 +1,97 @@
+'''
+Single-flight coalescing for hot read endpoints.
+'''
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Call(object):
+  __slots__ = ('done', 'value', 'error')
+
+  def __init__(self):
+    self.done = threading.Event()
+    self.value = None
+    self.error = None
+
+'''
+SingleFlight
+    shares one computation between concurrent identical requests. The
+    first request for a key (the leader) computes the value. Requests that
+    arrive while it is running wait for that result instead of running the
+    same queries. A finished value is kept for ttl seconds, up to
+    max_entries keys. It is only reused while the version it was computed
+    at is current, so a write in this process is visible immediately; the
+    TTL bounds how stale a write from another process can look.
+
+    Counters: hits (served a kept value), shared (waited for a leader) and
+    misses (computed).
+'''
+class SingleFlight(object):
+
+  def __init__(self, ttl=1.0, max_entries=256):
+    self.ttl = ttl
+    self.max_entries = max_entries
+    self.lock = threading.Lock()
+    self.calls = {}
+    # key -> (expires, version, value), oldest first
+    self.entries = OrderedDict()
+    self.hits = 0
+    self.shared = 0
+    self.misses = 0
+
+  def do(self, key, version, compute):
+    '''compute()'s value for key at version, computed at most once at a time.'''
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is not None:
+        if entry[0] > time.monotonic() and entry[1] == version:
+          self.hits += 1
+          return entry[2]
+        del self.entries[key]
+      call = self.calls.get((key, version))
+      leader = call is None
+      if leader:
+        call = self.calls[(key, version)] = _Call()
+        self.misses += 1
+      else:
+        self.shared += 1
+
+    if not leader:
+      call.done.wait()
+      if call.error is not None:
+        raise call.error
+      return call.value
+
+    try:
+      call.value = compute()
+    except BaseException as e:
+      # waiters see the same failure; nothing is kept
+      call.error = e
+      raise
+    else:
+      if self.ttl > 0:
+        with self.lock:
+          self.entries[key] = (time.monotonic() + self.ttl, version, call.value)
+          self.entries.move_to_end(key)
+          if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+    finally:
+      with self.lock:
+        del self.calls[(key, version)]
+      call.done.set()
+    return call.value
+
+  def metrics(self):
+    with self.lock:
+      requests = self.hits + self.shared + self.misses
+      return {
+        'requests': requests,
+        'hits': self.hits,
+        'shared': self.shared,
+        'misses': self.misses,
+        # share of requests that did not run their own queries
+        'hit_rate': (self.hits + self.shared) / requests if requests else 0.0,
+        'in_flight': len(self.calls),
+        'entries': len(self.entries)
+      }
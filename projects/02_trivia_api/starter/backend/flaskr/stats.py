@@ -0,0 +1,87 @@
+'''
+Question counts per category and difficulty for GET /stats.
+'''
+import threading
+
+from sqlalchemy import func, select
+
+from models import Question
+
+# one row per (category, difficulty) with its question count
+STATS_QUERY = select([Question.category, Question.difficulty, func.count(Question.id).label('count')]) \
+  .group_by(Question.category, Question.difficulty)
+
+'''
+QuestionStats
+    (category, difficulty) -> question count, loaded with a single GROUP BY
+    per question version. create_question and delete_question adjust the
+    counts in place. Any other write (bulk import, CLI, another process)
+    makes the counts stale and they are reloaded on the next read.
+'''
+class QuestionStats(object):
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.version = None
+    self.counts = {}
+
+  def load(self, version, rows):
+    # rows: STATS_QUERY results
+    counts = {(row['category'], row['difficulty']): row['count'] for row in rows}
+    with self.lock:
+      self.counts = counts
+      self.version = version
+
+  def adjust(self, before, after, category, difficulty, delta):
+    '''
+    Apply one insert (delta=1) or delete (delta=-1) that moved the question
+    version from before to after. The counts must have been current at
+    before, and nothing else can have been written in between. Otherwise
+    the counts are dropped.
+    '''
+    with self.lock:
+      if self.version != before or after != before + 1:
+        self.version = None
+        return
+      key = (category, difficulty)
+      count = self.counts.get(key, 0) + delta
+      if count > 0:
+        self.counts[key] = count
+      else:
+        self.counts.pop(key, None)
+      self.version = after
+
+  def summary(self, category_types):
+    '''The /stats body: totals per category, per difficulty and overall.'''
+    with self.lock:
+      counts = list(self.counts.items())
+
+    # every category is listed, including empty ones
+    categories = {
+      category: {'type': category_type, 'total_questions': 0, 'difficulties': {}}
+      for category, category_type in category_types.items()
+    }
+    difficulties = {}
+    total = uncategorized = 0
+    for (category, difficulty), count in counts:
+      total += count
+      if difficulty is not None:
+        difficulties[difficulty] = difficulties.get(difficulty, 0) + count
+      if category is None:
+        uncategorized += count
+        continue
+      entry = categories.setdefault(category, {
+        'type': category_types.get(category),
+        'total_questions': 0,
+        'difficulties': {}
+      })
+      entry['total_questions'] += count
+      if difficulty is not None:
+        entry['difficulties'][difficulty] = entry['difficulties'].get(difficulty, 0) + count
+
+    return {
+      'total_questions': total,
+      'categories': categories,
+      'difficulties': difficulties,
+      'uncategorized': uncategorized
+    }
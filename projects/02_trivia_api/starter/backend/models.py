@@ -1,6 +1,11 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import Column, String, Integer, BigInteger, Boolean, DateTime, ForeignKey, create_engine, event
+from sqlalchemy.orm import Session
 from flask_sqlalchemy import SQLAlchemy
+from itertools import chain
 import json
 
 database_name = "trivia"
@@ -12,17 +17,20 @@ db = SQLAlchemy()
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+    and, unless create_tables is False, creates any missing tables
 '''
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=database_path, create_tables=True):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     db.app = app
     db.init_app(app)
-    db.create_all()
+    if create_tables:
+        db.create_all()
 
 '''
 Question
-
+    text_key is a hash of the normalized question text (set by
+    flaskr.dedup), unique so that no process can store an exact duplicate.
 '''
 class Question(db.Model):  
   __tablename__ = 'questions'
@@ -30,8 +38,9 @@ class Question(db.Model):
   id = Column(Integer, primary_key=True)
   question = Column(String)
   answer = Column(String)
-  category = Column(String)
+  category = Column(Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='SET NULL'), index=True)
   difficulty = Column(Integer)
+  text_key = Column(BigInteger, index=True, unique=True)
 
   def __init__(self, question, answer, category, difficulty):
     self.question = question
@@ -72,8 +81,199 @@ class Category(db.Model):
   def __init__(self, type):
     self.type = type
 
+  def insert(self):
+    db.session.add(self)
+    db.session.commit()
+  
+  def update(self):
+    db.session.commit()
+
+  def delete(self):
+    db.session.delete(self)
+    db.session.commit()
+
   def format(self):
     return {
       'id': self.id,
       'type': self.type
-    }
\ No newline at end of file
+    }
+
+'''
+QuizResult
+    one finished quiz: the player's score out of total questions asked.
+    category is the quiz category played, 0 for all categories.
+'''
+class QuizResult(db.Model):
+  __tablename__ = 'quiz_results'
+
+  id = Column(Integer, primary_key=True)
+  player = Column(String(50), nullable=False, index=True)
+  category = Column(Integer, nullable=False)
+  score = Column(Integer, nullable=False)
+  total = Column(Integer, nullable=False)
+  played_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+  def __init__(self, player, category, score, total):
+    self.player = player
+    self.category = category
+    self.score = score
+    self.total = total
+
+  def format(self):
+    return {
+      'id': self.id,
+      'player': self.player,
+      'category': self.category,
+      'score': self.score,
+      'total': self.total,
+      'played_at': self.played_at.isoformat() if self.played_at else None
+    }
+
+'''
+AnswerOutcome
+    whether one answer to a question was correct; player is optional.
+'''
+class AnswerOutcome(db.Model):
+  __tablename__ = 'answer_outcomes'
+
+  id = Column(Integer, primary_key=True)
+  question_id = Column(Integer, ForeignKey('questions.id', ondelete='CASCADE'), nullable=False, index=True)
+  player = Column(String(50))
+  correct = Column(Boolean, nullable=False)
+  answered_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+  def __init__(self, question_id, correct, player=None):
+    self.question_id = question_id
+    self.correct = correct
+    self.player = player
+
+  def format(self):
+    return {
+      'id': self.id,
+      'question_id': self.question_id,
+      'player': self.player,
+      'correct': self.correct,
+      'answered_at': self.answered_at.isoformat() if self.answered_at else None
+    }
+
+'''
+DataVersion
+    a shared version number per table, so every process (web workers, the
+    ASGI app, the flask CLI) learns about writes made by the others.
+'''
+class DataVersion(db.Model):
+  __tablename__ = 'data_versions'
+
+  name = Column(String(50), primary_key=True)
+  version = Column(Integer, nullable=False, default=0)
+
+'''
+category_version(), question_version()
+    counters bumped once per commit that inserted, updated or deleted rows
+    of the model through the ORM, so in-process caches know when to
+    rebuild. They move after the commit, not at flush: a reader between the
+    two would otherwise cache the old rows at the new version.
+
+    Writes are also published to data_versions, and sync_versions() bumps
+    the local counters when another process has published, so caches in
+    every process catch up within VERSION_CHECK_INTERVAL seconds.
+'''
+_versions = {Category: 0, Question: 0}
+_tables = {Category.__tablename__: Category, Question.__tablename__: Question}
+# the data_versions values this process has accounted for
+_shared = {}
+_shared_lock = threading.Lock()
+_last_sync = [0.0]
+
+def category_version():
+  return _versions[Category]
+
+def question_version():
+  return _versions[Question]
+
+def touch_version(model):
+  _versions[model] += 1
+
+def publish_statements(models):
+  '''Statements that bump the shared versions of models; run them in the writing transaction or after it.'''
+  names = sorted(model.__tablename__ for model in models)
+  table = DataVersion.__table__
+  return [table.update().where(table.c.name.in_(names)).values(version=table.c.version + 1)]
+
+def published(models, rows):
+  '''
+  Account for this process's own publish: touch the local counters, and
+  when rows (the data_versions after the bump) show nobody else wrote in
+  between, remember them so sync_versions() does not reload again.
+  '''
+  with _shared_lock:
+    for model in models:
+      touch_version(model)
+    for name, version in rows:
+      if name in _tables and _tables[name] in models and _shared.get(name) == version - 1:
+        _shared[name] = version
+
+def publish_versions(bind, models):
+  '''Bump the local and shared versions of models after a commit that changed them.'''
+  models = set(models)
+  if not models:
+    return
+  table = DataVersion.__table__
+  try:
+    with bind.begin() as connection:
+      for statement in publish_statements(models):
+        connection.execute(statement)
+      rows = connection.execute(table.select().where(
+        table.c.name.in_([model.__tablename__ for model in models]))).fetchall()
+  except Exception:
+    # no data_versions table yet (schema not set up): other processes fall back to their own writes
+    rows = []
+  published(models, [(row[0], row[1]) for row in rows])
+
+def apply_versions(rows):
+  '''Touch the local counter of every table whose shared version moved since the last sync.'''
+  with _shared_lock:
+    for name, version in rows:
+      model = _tables.get(name)
+      if model is None:
+        continue
+      if name in _shared and _shared[name] != version:
+        touch_version(model)
+      _shared[name] = version
+
+def versions_due(interval):
+  '''True at most once every interval seconds, for the caller that should sync.'''
+  now = time.monotonic()
+  with _shared_lock:
+    if now - _last_sync[0] < interval:
+      return False
+    _last_sync[0] = now
+    return True
+
+def sync_versions(bind, interval=0):
+  if not versions_due(interval):
+    return
+  try:
+    rows = bind.execute(DataVersion.__table__.select()).fetchall()
+  except Exception:
+    return
+  apply_versions([(row[0], row[1]) for row in rows])
+
+def record_flushed_versions(session, flush_context):
+  # new/dirty/deleted still hold the pre-flush state here
+  touched = session.info.setdefault('touched_versions', set())
+  for instance in chain(session.new, session.dirty, session.deleted):
+    if type(instance) in _versions:
+      touched.add(type(instance))
+
+def bump_committed_versions(session):
+  touched = session.info.pop('touched_versions', ())
+  if touched:
+    publish_versions(session.get_bind(), touched)
+
+def discard_flushed_versions(session):
+  session.info.pop('touched_versions', None)
+
+event.listen(Session, 'after_flush', record_flushed_versions)
+event.listen(Session, 'after_commit', bump_committed_versions)
+event.listen(Session, 'after_rollback', discard_flushed_versions)
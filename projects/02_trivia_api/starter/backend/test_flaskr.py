@@ -1,10 +1,60 @@
 import os
+import asyncio
 import unittest
 import json
 from flask_sqlalchemy import SQLAlchemy
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    from flaskr.asgi import create_asgi_app
+except ImportError:
+    # the ASGI app needs starlette and databases
+    create_asgi_app = None
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr.schema import SCHEMA_VERSION, schema_version
+from flaskr.bulk import import_questions, ImportFailed
+from flaskr.dedup import question_key
+from models import setup_db, db, Question, Category, QuizResult, AnswerOutcome
+
+
+def call_asgi(app, requests):
+    """Send (method, path, body) requests to an ASGI app in turn; returns (status, JSON body) pairs."""
+    async def call(method, path, body):
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http', 'http_version': '1.1', 'method': method, 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+            'headers': [(b'host', b'localhost'), (b'content-type', b'application/json')],
+            'server': ('localhost', 80), 'client': ('127.0.0.1', 1234)
+        }
+        messages = [{'type': 'http.request', 'body': json.dumps(body).encode() if body is not None else b''}]
+        response = {'body': b''}
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await asyncio.Event().wait()
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+            else:
+                response['body'] += message.get('body', b'')
+
+        await app(scope, receive, send)
+        return response['status'], json.loads(response['body'])
+
+    async def run():
+        await app.state.database.connect()
+        try:
+            return [await call(*request) for request in requests]
+        finally:
+            await app.state.database.disconnect()
+
+    return asyncio.run(run())
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -12,27 +62,77 @@ class TriviaTestCase(unittest.TestCase):
 
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = create_app()
-        self.client = self.app.test_client
         self.database_name = "trivia_test"
         self.database_path = "postgres://{}/{}".format('suresh:fsd@localhost:5432', self.database_name)
-        setup_db(self.app, self.database_path)
-
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
+        # create_app checks the schema once per process, not once per test
+        self.app = create_app({'DATABASE_PATH': self.database_path})
+        self.client = self.app.test_client
     
     def tearDown(self):
         """Executed after reach test"""
         pass
 
+    def delete_questions(self, *texts):
+        """Remove questions a test imported, so the suite can run again on the same database."""
+        with self.app.app_context():
+            for question in Question.query.filter(Question.question.in_(texts)):
+                question.delete()
+
     """
     TODO
     Write at least one test for each test for successful operation and for expected errors.
     """
+    @unittest.skipIf(create_asgi_app is None, 'the ASGI app needs starlette and databases')
+    def test_asgi_matches_wsgi(self):
+        with self.app.app_context():
+            ids = [question.id for question in Question.query.filter_by(category=1).order_by(Question.id)]
+            existing = Question.query.get(ids[0]).question
+        requests = [
+            ('GET', '/categories', None),
+            ('GET', '/questions?page=1', None),
+            ('GET', '/questions?page=1000', None),
+            ('GET', '/categories/1/questions', None),
+            ('GET', '/categories/1000/questions', None),
+            ('POST', '/questions/search', {'searchTerm': 'title'}),
+            ('POST', '/questions/search', {'searchTerm': 'no question says this'}),
+            ('POST', '/questions', {'question': existing, 'answer': 'x', 'category': 1, 'difficulty': 1}),
+            ('POST', '/questions', {'question': 'Missing fields?'}),
+            ('POST', '/quizzes', {'previous_questions': ids[1:], 'quiz_category': {'id': 1}}),
+            ('POST', '/quizzes', {'previous_questions': ids, 'quiz_category': {'id': 1}}),
+            ('POST', '/quizzes', {'previous_questions': 'abc', 'quiz_category': {'id': 1}}),
+            ('POST', '/quizzes', {'previous_questions': [], 'quiz_category': {'id': 1}, 'correct': True}),
+            ('POST', '/quizzes/answer', {'question_id': 20, 'answer': 'liver'}),
+            ('POST', '/quizzes/answer', {'question_id': 100000, 'answer': 'liver'}),
+            ('GET', '/stats', None),
+        ]
+        expected = []
+        for method, path, body in requests:
+            res = self.client().open(path, method=method, json=body)
+            expected.append((res.status_code, json.loads(res.data)))
+
+        asgi = create_asgi_app({'DATABASE_PATH': self.database_path})
+        for request, wsgi_response, asgi_response in zip(requests, expected, call_asgi(asgi, requests)):
+            self.assertEqual(asgi_response, wsgi_response, request)
+
+    def test_schema_version_recorded(self):
+        with self.app.app_context():
+            version = db.session.execute(schema_version.select()).scalar()
+
+        self.assertEqual(version, SCHEMA_VERSION)
+
+    def test_skip_schema_check(self):
+        app = create_app({'DATABASE_PATH': self.database_path, 'SKIP_SCHEMA_CHECK': True})
+        res = app.test_client().get('/categories')
+
+        self.assertEqual(res.status_code, 200)
+
+    def test_json_providers_match(self):
+        app = create_app({'DATABASE_PATH': self.database_path, 'JSON_PROVIDER': 'default'})
+        expected = json.loads(app.test_client().get('/questions').data)
+        data = json.loads(self.client().get('/questions').data)
+
+        self.assertEqual(data, expected)
+
     def test_get_categories(self):
         res = self.client().get('/categories')
         data = json.loads(res.data)
@@ -42,6 +142,27 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['categories'])
         self.assertEqual(len(data['categories']), 6)
 
+    def test_get_categories_not_modified(self):
+        res = self.client().get('/categories')
+        etag = res.headers['ETag']
+
+        res = self.client().get('/categories', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers['ETag'], etag)
+
+    def test_get_categories_after_category_write(self):
+        with self.app.app_context():
+            category = Category(type='Music')
+            category.insert()
+            res = self.client().get('/categories')
+            data = json.loads(res.data)
+            category.delete()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_categories'], 7)
+        self.assertIn('Music', data['categories'].values())
+
     def test_get_paginated_questions(self):
         res = self.client().get('/questions')
         data = json.loads(res.data)
@@ -59,6 +180,23 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['error'], 404)
         self.assertEqual(data['success'], False)
 
+    def test_get_questions_after_id(self):
+        res = self.client().get('/questions?after_id=10')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['total_questions'])
+        self.assertTrue(all(question['id'] > 10 for question in data['questions']))
+        self.assertEqual(data['questions'][0]['id'], 11)
+
+    def test_invalid_after_id(self):
+        res = self.client().get('/questions?after_id=100000')
+        data = json.loads(res.data)
+
+        self.assertEqual(data['error'], 404)
+        self.assertEqual(data['success'], False)
+
     def test_delete_questions(self):
         res = self.client().delete('questions/5')
         data = json.loads(res.data)
@@ -84,6 +222,41 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['total_questions'])
         self.assertEqual(len(data['questions']), 1)
 
+    def test_ranked_search_question(self):
+        res = self.client().post('questions/search', json={"searchTerm": "Lake Victoria", "ranked": True, "highlight": True})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['total_questions'], 1)
+        self.assertEqual(data['questions'][0]['id'], 13)
+        self.assertIn('snippet', data['questions'][0])
+
+    def test_ranked_search_snippet_escaped(self):
+        text = 'Which <script> tag runs code in a web page?'
+        self.client().post('/questions', json={'question': text, 'answer': 'script', 'category': 1, 'difficulty': 2})
+        res = self.client().post('questions/search', json={"searchTerm": "web page", "ranked": True, "highlight": True})
+        data = json.loads(res.data)
+        self.delete_questions(text)
+
+        self.assertEqual(data['questions'][0]['snippet'],
+                         'Which &lt;script&gt; tag runs code in a <mark>web</mark> <mark>page</mark>?')
+
+    def test_ranked_search_ranks_question_and_answer(self):
+        res = self.client().post('questions/search', json={"searchTerm": "soccer World Cup", "ranked": True})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], 2)
+        self.assertEqual(sorted(question['id'] for question in data['questions']), [10, 11])
+
+    def test_empty_search_term(self):
+        res = self.client().post('questions/search', json={"searchTerm": ""})
+        data = json.loads(res.data)
+
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['error'], 422)
+
     def test_create_question(self):
         new_question = {
         'question': 'Which sport is popular in India?',
@@ -94,10 +267,175 @@ class TriviaTestCase(unittest.TestCase):
 
         res = self.client().post('/questions', json=new_question)
         data = json.loads(res.data)
+        self.client().delete('/questions/{}'.format(data['created']['id']))
 
         self.assertEqual(data['success'], True)
         self.assertTrue(data['created'])
 
+    def test_create_exact_duplicate_question(self):
+        res = self.client().post('/questions', json={
+            'question': 'What boxer\'s original name is Cassius Clay',
+            'answer': 'Ali',
+            'category': 4,
+            'difficulty': 1,
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['similarity'], 1.0)
+        self.assertTrue(data['duplicate_of'])
+
+    def test_create_duplicate_stored_by_another_process(self):
+        text = 'What is the tallest volcano in the solar system?'
+        # builds this process's duplicate index before the other process writes
+        self.client().post('/questions', json={
+            'question': 'What boxer\'s original name is Cassius Clay', 'answer': 'Ali', 'category': 4, 'difficulty': 1})
+        with self.app.app_context():
+            db.session.execute(Question.__table__.insert(), {
+                'question': text, 'answer': 'Olympus Mons', 'category': 1, 'difficulty': 3, 'text_key': question_key(text)})
+            db.session.commit()
+
+        res = self.client().post('/questions', json={
+            'question': text.upper(), 'answer': 'Olympus Mons', 'category': 1, 'difficulty': 3})
+        data = json.loads(res.data)
+        self.delete_questions(text)
+
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(data['similarity'], 1.0)
+
+    def test_create_near_duplicate_question(self):
+        new_question = {
+            'question': 'In which royal palace could you find the Hall of Mirrors?',
+            'answer': 'The Palace of Versailles',
+            'category': 3,
+            'difficulty': 3,
+        }
+
+        res = self.client().post('/questions', json=new_question)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 409)
+        self.assertGreaterEqual(data['similarity'], 0.8)
+
+        res = self.client().post('/questions', json=dict(new_question, allow_duplicate=True))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.client().delete('/questions/{}'.format(data['created']['id']))
+
+    def test_hot_reads_share_responses(self):
+        first = self.client().get('/questions?page=2')
+        before = json.loads(self.client().get('/stats/hot-reads').data)
+        second = self.client().get('/questions?page=2')
+        after = json.loads(self.client().get('/stats/hot-reads').data)
+
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(after['hits'], before['hits'] + 1)
+        self.assertEqual(after['misses'], before['misses'])
+        self.assertGreater(after['hit_rate'], 0)
+
+    def test_hot_reads_follow_writes(self):
+        total = json.loads(self.client().get('/questions').data)['total_questions']
+        res = self.client().post('/questions', json={
+            'question': 'Which planet has the most moons?',
+            'answer': 'Saturn',
+            'category': 1,
+            'difficulty': 3,
+        })
+        created = json.loads(res.data)['created']
+        after_create = json.loads(self.client().get('/questions').data)['total_questions']
+        self.client().delete('/questions/{}'.format(created['id']))
+
+        self.assertEqual(after_create, total + 1)
+
+    def test_get_stats(self):
+        res = self.client().get('/stats')
+        data = json.loads(res.data)
+        total = json.loads(self.client().get('/questions').data)['total_questions']
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['total_questions'], total)
+        self.assertEqual(sum(data['difficulties'].values()), total)
+        self.assertEqual(len(data['categories']), 6)
+
+    def test_stats_follow_create_and_delete(self):
+        before = json.loads(self.client().get('/stats').data)
+        res = self.client().post('/questions', json={
+            'question': 'How many players are on a cricket team?',
+            'answer': 'Eleven',
+            'category': 6,
+            'difficulty': 5,
+        })
+        created = json.loads(res.data)['created']
+        after_create = json.loads(self.client().get('/stats').data)
+        self.client().delete('/questions/{}'.format(created['id']))
+        after_delete = json.loads(self.client().get('/stats').data)
+
+        self.assertEqual(after_create['total_questions'], before['total_questions'] + 1)
+        self.assertEqual(after_create['categories']['6']['difficulties']['5'],
+                         before['categories']['6']['difficulties'].get('5', 0) + 1)
+        self.assertEqual(after_delete, before)
+
+    def test_bulk_create_questions(self):
+        lines = [
+            json.dumps({'question': 'Who painted The Starry Night?', 'answer': 'Van Gogh', 'category': 2, 'difficulty': 2}),
+            json.dumps({'question': 'Missing answer', 'category': 2, 'difficulty': 2}),
+            'not json',
+            json.dumps({'question': 'What is H2O?', 'answer': 'Water', 'category': '1', 'difficulty': 1}),
+        ]
+
+        res = self.client().post('/questions/bulk', data='\n'.join(lines), content_type='application/x-ndjson')
+        data = json.loads(res.data)
+        self.delete_questions('Who painted The Starry Night?', 'What is H2O?')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['inserted'], 2)
+        self.assertEqual(data['total_errors'], 2)
+        self.assertEqual([error['line'] for error in data['errors']], [2, 3])
+
+    def test_bulk_import_failure_reports_progress(self):
+        def lines():
+            yield json.dumps({'question': 'Who wrote Middlemarch?', 'answer': 'George Eliot', 'category': 4, 'difficulty': 3})
+            yield json.dumps({'question': 'Who wrote Persuasion?', 'answer': 'Jane Austen', 'category': 4, 'difficulty': 2})
+            raise OSError('connection reset')
+
+        with self.app.app_context():
+            with self.assertRaises(ImportFailed) as failed:
+                import_questions(lines(), {4: 'History'}, batch_size=1)
+        self.delete_questions('Who wrote Middlemarch?', 'Who wrote Persuasion?')
+
+        self.assertEqual(failed.exception.inserted, 2)
+        self.assertEqual(failed.exception.line, 3)
+
+    def test_bulk_create_reports_duplicates(self):
+        lines = [
+            json.dumps({'question': 'what is the LARGEST lake in Africa', 'answer': 'Lake Victoria', 'category': 3, 'difficulty': 2}),
+            json.dumps({'question': 'Which river is the longest in Europe?', 'answer': 'Volga', 'category': 3, 'difficulty': 3}),
+            json.dumps({'question': 'which river is the LONGEST in Europe', 'answer': 'Volga', 'category': 3, 'difficulty': 3}),
+        ]
+
+        res = self.client().post('/questions/bulk', data='\n'.join(lines), content_type='application/x-ndjson')
+        data = json.loads(res.data)
+        self.delete_questions('Which river is the longest in Europe?')
+
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual([error['line'] for error in data['errors']], [1, 3])
+        self.assertTrue(data['errors'][0]['error'].startswith('duplicate of question'))
+        self.assertEqual(data['errors'][1]['error'], 'duplicate of line 2')
+
+    def test_export_questions(self):
+        res = self.client().get('/questions/export')
+        rows = [json.loads(line) for line in res.data.decode('utf-8').splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertTrue(rows)
+        self.assertEqual(sorted(rows[0].keys()), ['answer', 'category', 'difficulty', 'id', 'question'])
+        self.assertEqual([row['id'] for row in rows], sorted(row['id'] for row in rows))
+
     def test_invalid_category_create_question(self):
         new_question = {
         'question': 'Which sport is popular in India?',
@@ -113,6 +451,20 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['error'], 422)
         self.assertEqual(data['message'], "Unable to process. Invalid input...")
 
+    def test_unknown_category_create_question(self):
+        new_question = {
+        'question': 'Which sport is popular in India?',
+        'answer': 'Cricket',
+        'category': 100,
+        'difficulty': 1,
+        }
+
+        res = self.client().post('/questions', json=new_question)
+        data = json.loads(res.data)
+
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['error'], 422)
+
     def test_invalid_difficulty_create_question(self):
         new_question = {
         'question': 'Which sport is popular in India?',
@@ -177,6 +529,277 @@ class TriviaTestCase(unittest.TestCase):
 
         self.assertEqual(data['question']['category'], 5)
 
+    def test_play_quiz_game_over(self):
+        input_data = {
+            'previous_questions':[2, 4, 6],
+            'quiz_category': {
+                'id': 5,
+                'type': 'Entertainment'
+            }
+        }
+
+        res = self.client().post('/quizzes', json=input_data)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['message'], 'game over')
+
+    def test_play_quiz_question_deleted_elsewhere(self):
+        input_data = {'previous_questions': [2, 4, 6], 'quiz_category': {'id': 5}}
+        with self.app.app_context():
+            question = Question('Which film won the first Academy Award for Best Picture?', 'Wings', 5, 3)
+            question.insert()
+            question_id = question.id
+        res = self.client().post('/quizzes', json=input_data)
+        self.assertEqual(json.loads(res.data)['question']['id'], question_id)
+
+        # a Core delete, as another process would make it: no local version bump
+        with self.app.app_context():
+            db.session.execute(Question.__table__.delete().where(Question.id == question_id))
+            db.session.commit()
+        res = self.client().post('/quizzes', json=input_data)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['message'], 'game over')
+
+    def test_play_quiz_invalid_category(self):
+        input_data = {
+            'previous_questions':[],
+            'quiz_category': {
+                'type': 'Entertainment'
+            }
+        }
+
+        res = self.client().post('/quizzes', json=input_data)
+        data = json.loads(res.data)
+
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['error'], 422)
+
+    def test_play_quiz_invalid_previous_questions(self):
+        statuses = [self.client().post('/quizzes', json={
+            'previous_questions': previous,
+            'quiz_category': {'id': 0}
+        }).status_code for previous in (5, 'abc', {'id': 2}, [2, '4'], [[2]])]
+
+        self.assertEqual(statuses, [422] * 5)
+
+    def test_play_quiz_session(self):
+        res = self.client().post('/quizzes', json={'quiz_category': {'id': 5, 'type': 'Entertainment'}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['quiz_session'])
+        seen = [data['question']['id']]
+
+        for _ in range(2):
+            res = self.client().post('/quizzes', json={'quiz_session': data['quiz_session']})
+            data = json.loads(res.data)
+            self.assertNotIn(data['question']['id'], seen)
+            seen.append(data['question']['id'])
+
+        res = self.client().post('/quizzes', json={'quiz_session': data['quiz_session']})
+        data = json.loads(res.data)
+
+        self.assertEqual(sorted(seen), [2, 4, 6])
+        self.assertEqual(data['message'], 'game over')
+
+    def test_play_quiz_adaptive(self):
+        res = self.client().post('/quizzes', json={'quiz_category': {'id': 0, 'type': 'All'}, 'adaptive': True})
+        data = json.loads(res.data)
+
+        self.assertEqual(data['difficulty'], 1)
+        self.assertEqual(data['question']['difficulty'], 1)
+
+        for _ in range(2):
+            self.client().post('/quizzes/answer', json={
+                'quiz_session': data['quiz_session'],
+                'question_id': data['question']['id'],
+                'answer': data['question']['answer']
+            })
+            res = self.client().post('/quizzes', json={'quiz_session': data['quiz_session']})
+            data = json.loads(res.data)
+
+        self.assertEqual(data['difficulty'], 2)
+        self.assertEqual(data['question']['difficulty'], 2)
+
+        self.client().post('/quizzes/answer', json={
+            'quiz_session': data['quiz_session'],
+            'question_id': data['question']['id'],
+            'answer': 'no idea'
+        })
+        res = self.client().post('/quizzes', json={'quiz_session': data['quiz_session']})
+        data = json.loads(res.data)
+
+        self.assertEqual(data['difficulty'], 1)
+
+    def test_record_quiz_result(self):
+        res = self.client().post('/quizzes', json={'quiz_category': {'id': 1}, 'player': 'Ada'})
+        data = json.loads(res.data)
+        session_id = data['quiz_session']
+        while 'question' in data:
+            self.client().post('/quizzes/answer', json={
+                'quiz_session': session_id,
+                'question_id': data['question']['id'],
+                'answer': data['question']['answer']
+            })
+            data = json.loads(self.client().post('/quizzes', json={'quiz_session': session_id}).data)
+        res = self.client().post('/quizzes/results', json={'quiz_session': session_id})
+        data = json.loads(res.data)
+        self.app.extensions['result_recorder'].flush()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['rank'], 1)
+        self.assertEqual(data['score'], data['total'])
+        leaders = json.loads(self.client().get('/leaderboard?category=1').data)['leaders']
+        self.assertEqual(leaders[0], {'rank': 1, 'player': 'Ada', 'score': data['score']})
+        with self.app.app_context():
+            self.assertTrue(QuizResult.query.filter_by(player='Ada', score=data['score']).count())
+
+    def test_record_quiz_session_result(self):
+        res = self.client().post('/quizzes', json={'quiz_category': {'id': 2}, 'player': 'Grace'})
+        data = json.loads(res.data)
+        question_id = data['question']['id']
+        self.client().post('/quizzes/answer', json={
+            'quiz_session': data['quiz_session'],
+            'question_id': question_id,
+            'answer': data['question']['answer']
+        })
+        res = self.client().post('/quizzes/results', json={'quiz_session': data['quiz_session']})
+        result = json.loads(res.data)
+        self.app.extensions['result_recorder'].flush()
+
+        self.assertEqual((result['player'], result['score'], result['total']), ('Grace', 1, 1))
+        with self.app.app_context():
+            outcome = AnswerOutcome.query.filter_by(player='Grace', question_id=question_id).first()
+        self.assertTrue(outcome.correct)
+        res = self.client().post('/quizzes', json={'quiz_session': data['quiz_session']})
+        self.assertEqual(res.status_code, 404)
+
+    def test_check_quiz_answer(self):
+        verdicts = [json.loads(self.client().post('/quizzes/answer', json={
+            'question_id': question_id,
+            'answer': answer
+        }).data) for question_id, answer in ((20, 'liver'), (19, 'jackson polock'), (18, '1'), (20, 'Heart'))]
+
+        self.assertEqual([verdict['correct'] for verdict in verdicts], [True, True, True, False])
+        self.assertEqual(verdicts[0]['answer'], 'The Liver')
+
+    def test_check_quiz_answer_in_session(self):
+        res = self.client().post('/quizzes', json={'quiz_category': {'id': 2}, 'player': 'Linus', 'hide_answer': True})
+        data = json.loads(res.data)
+        question = data['question']
+        res = self.client().post('/quizzes/answer', json={
+            'quiz_session': data['quiz_session'],
+            'question_id': question['id'],
+            'answer': 'no idea'
+        })
+        verdict = json.loads(res.data)
+        result = json.loads(self.client().post('/quizzes/results', json={'quiz_session': data['quiz_session']}).data)
+
+        self.assertNotIn('answer', question)
+        self.assertEqual(verdict['correct'], False)
+        self.assertTrue(verdict['answer'])
+        self.assertEqual((result['score'], result['total']), (0, 1))
+
+    def test_check_quiz_answer_unknown_question(self):
+        res = self.client().post('/quizzes/answer', json={'question_id': 100000, 'answer': 'liver'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        res = self.client().post('/quizzes/answer', json={'question_id': 20})
+        self.assertEqual(res.status_code, 422)
+
+    @unittest.skipIf(numpy is None, 'calibration needs NumPy')
+    def test_calibrate_difficulty(self):
+        with self.app.app_context():
+            db.session.add_all([AnswerOutcome(20, True) for _ in range(40)])
+            db.session.commit()
+        runner = self.app.test_cli_runner()
+
+        dry_run = runner.invoke(args=['calibrate-difficulty', '--min-attempts', '40', '--dry-run'])
+        with self.app.app_context():
+            self.assertEqual(Question.query.get(20).difficulty, 4)
+        result = runner.invoke(args=['calibrate-difficulty', '--min-attempts', '40'])
+        with self.app.app_context():
+            question = Question.query.get(20)
+            calibrated = question.difficulty
+            question.difficulty = 4
+            AnswerOutcome.query.filter_by(question_id=20, player=None).delete()
+            db.session.commit()
+
+        self.assertIn('question 20: difficulty 4 -> 1', dry_run.output)
+        self.assertIn('1 difficulties changed', result.output)
+        self.assertEqual(calibrated, 1)
+
+    def test_invalid_quiz_result(self):
+        res = self.client().post('/quizzes/results', json={
+            'player': 'Ada',
+            'quiz_category': {'id': 1},
+            'score': 5,
+            'total': 5
+        })
+        data = json.loads(res.data)
+        session_id = json.loads(self.client().post('/quizzes', json={'quiz_category': {'id': 1}, 'player': 'Ada'}).data)['quiz_session']
+        claimed = self.client().post('/quizzes/results', json={'quiz_session': session_id, 'score': 5, 'total': 5})
+        reported = self.client().post('/quizzes', json={'quiz_session': session_id, 'correct': True})
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(claimed.status_code, 422)
+        self.assertEqual(reported.status_code, 422)
+
+    def test_multiplayer_room(self):
+        res = self.client().post('/rooms', json={'player': 'Ada', 'quiz_category': {'id': 2}})
+        code = json.loads(res.data)['room']['code']
+        self.client().post('/rooms/{}/join'.format(code), json={'player': 'Grace'})
+        events = self.client().get('/rooms/{}/events'.format(code), buffered=False)
+        first_event = next(events.response)
+        res = self.client().post('/rooms/{}/next'.format(code), json={'player': 'Ada'})
+        question = json.loads(res.data)['question']
+        with self.app.app_context():
+            answer = Question.query.get(question['id']).answer
+        res = self.client().post('/rooms/{}/answer'.format(code), json={'player': 'Grace', 'answer': answer})
+        data = json.loads(res.data)
+        pushed = next(events.response)
+        events.close()
+        room = json.loads(self.client().get('/rooms/{}'.format(code)).data)['room']
+
+        self.assertIn(b'"Grace": 0', first_event)
+        self.assertIn('"id": {}'.format(question['id']).encode(), pushed)
+        self.assertEqual(question['category'], 2)
+        self.assertNotIn('answer', question)
+        self.assertNotIn(b'"answer"', pushed)
+        self.assertNotIn('answer', room['question'])
+        self.assertTrue(data['correct'])
+        self.assertEqual(room['players'], {'Ada': 0, 'Grace': 1})
+        self.assertEqual(room['answered'], ['Grace'])
+
+    def test_room_only_host_advances(self):
+        res = self.client().post('/rooms', json={'player': 'Ada', 'quiz_category': {'id': 0}})
+        code = json.loads(res.data)['room']['code']
+        self.client().post('/rooms/{}/join'.format(code), json={'player': 'Grace'})
+        res = self.client().post('/rooms/{}/next'.format(code), json={'player': 'Grace'})
+
+        self.assertEqual(res.status_code, 422)
+
+    def test_unknown_room(self):
+        res = self.client().post('/rooms/NOPE42/join', json={'player': 'Ada'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
+    def test_play_quiz_unknown_session(self):
+        res = self.client().post('/quizzes', json={'quiz_session': 'not-a-session'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file